@@ -0,0 +1,295 @@
+'''
+Created on 18 oct. 2026
+
+@author: Miguel
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from disease import DiseaseSimulation, eulerLoopCompiled
+
+# Madrid example of main.py
+MADRID_N    = 6550000
+MADRID_DATA = [(17, 1990, 1, 81), (20, 4165, 474, 255), 
+               (23, 6777, 498, 941), (26, 9702, 1899, 1022)]
+MADRID_CONFIG = {'day_0': 17, 'print_logs': False,
+                 'initializers': {'infected_0': 1990, 'dead_0': 81, 'recovered_0': 1}}
+MADRID_RATES = {'contagious_rate': 0.2759, 'recovery_rate': 0.0336, 
+                'mortality_rate': 0.0268}
+
+# =============================================================================
+#   BACKENDS
+# =============================================================================
+
+def benchmarkBackends(repeat=3, backends=DiseaseSimulation.BACKENDS, **diseaseKwargs):
+    """
+    Time a run of the same model with each backend (the best of repeat runs)
+    and compare its trajectory with the one of the 'python' backend (the 
+    reference loop) and of the 'numpy' backend. 'numpy' and 'numba' compute
+    the four variables of a step from the previous state, 'python' uses the
+    susceptible and infected already updated in the step, so their results
+    differ by O(t_step); 'numba' has the results of 'numpy'. The first 
+    'numba' run compiles the loop, it is done before timing.
+    Args:
+    :repeat (=3) runs of each backend.
+    :backends (=DiseaseSimulation.BACKENDS) to compare.
+    :diseaseKwargs, the parameters for the DiseaseSimulation, by default a
+        run of 200 days of the Madrid population with t_step=0.001.
+
+    Return:
+    :<dict> backend: (seconds, speedup over 'python', max difference with 
+        'python', max difference with 'numpy')
+    """
+    diseaseKwargs = {'t_step': 0.001, 'days': 200, 'N_population': 6550000,
+                     'contagious_rate': 0.3, 'recovery_rate': 0.05,
+                     'mortality_rate': 0.01, 'print_logs': False,
+                     **diseaseKwargs}
+    references = {}
+    for backend in (DiseaseSimulation.BACKEND_PYTHON, DiseaseSimulation.BACKEND_NUMPY):
+        model = DiseaseSimulation(backend=backend, **diseaseKwargs)
+        model()
+        references[backend] = model._trajectory[:model._n]
+
+    results = {}
+    for backend in backends:
+        if backend == DiseaseSimulation.BACKEND_NUMBA:
+            DiseaseSimulation(backend=backend, **{**diseaseKwargs, 'days': 1})()
+        seconds = np.inf
+        for _ in range(repeat):
+            model = DiseaseSimulation(backend=backend, **diseaseKwargs)
+            t_0 = time.perf_counter()
+            model()
+            seconds = min(seconds, time.perf_counter() - t_0)
+        differences = []
+        for reference in references.values():
+            n = min(model._n, len(reference))
+            differences.append(np.abs(model._trajectory[:n] - reference[:n]).max())
+        results[backend] = (seconds, *differences)
+
+    t_python = results.get(DiseaseSimulation.BACKEND_PYTHON, (np.nan, ))[0]
+    print("backend\tseconds\tspeedup\tmax |y - y_python|\tmax |y - y_numpy|")
+    for backend, (seconds, d_python, d_numpy) in results.items():
+        name = backend
+        if (backend == DiseaseSimulation.BACKEND_NUMBA) and (eulerLoopCompiled is None):
+            name += ' (not installed, numpy loop)'
+        print(f"{name}\t{seconds:8.4f}\t{t_python / seconds:6.2f}\t"
+              f"{d_python:10.4g}\t{d_numpy:10.4g}")
+        results[backend] = (seconds, t_python / seconds, d_python, d_numpy)
+    return results
+
+# =============================================================================
+#   SUITE
+# =============================================================================
+# name: function that prepares a case and returns the callable to time, which
+# returns the number of steps (or of items) it has computed.
+BENCHMARKS = {}
+
+def benchmark(name):
+    """ Register a case of the suite. """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+def _simulationCase(backend, t_step, N_population, days=500):
+    def case():
+        if backend == DiseaseSimulation.BACKEND_NUMBA:
+            # compile (or load the cached compilation) before timing
+            DiseaseSimulation(backend=backend, days=1, **MADRID_RATES, **MADRID_CONFIG)()
+        def run():
+            model = DiseaseSimulation(t_step=t_step, days=days, N_population=N_population,
+                                      backend=backend, **MADRID_RATES, **MADRID_CONFIG)
+            model()
+            return model._n
+        return run
+    return case
+
+for _backend in DiseaseSimulation.BACKENDS:
+    for _t_step in (0.01, 0.005, 0.001):
+        for _N in (200000, MADRID_N):
+            if (_backend == DiseaseSimulation.BACKEND_PYTHON) and (_t_step < 0.005):
+                continue
+            benchmark('simulation {} t_step={} N={}'.format(_backend, _t_step, _N))(
+                _simulationCase(_backend, _t_step, _N))
+
+@benchmark('simulation rk45 N={}'.format(MADRID_N))
+def _rk45Case():
+    def run():
+        model = DiseaseSimulation(days=500, N_population=MADRID_N, method='rk45',
+                                  **MADRID_RATES, **MADRID_CONFIG)
+        model()
+        return model._n
+    return run
+
+@benchmark('runBatch 11 parameter sets t_step=0.005')
+def _batchCase():
+    params = ([(0.1 + 0.3*r, 1/20.) for r in range(5)] 
+              + [(1.25, 1./(2.1 + 4.*c)) for c in range(0, 6)])
+    def run():
+        results = DiseaseSimulation.runBatch(params, t_step=0.005, mortality_rate=0.04)
+        return results.trajectories.shape[0] * results.trajectories.shape[1]
+    return run
+
+@benchmark('stepOptimizer Madrid tolerance=0.005')
+def _stepOptimizerCase():
+    from optimizers import stepOptimizer
+    def run():
+        stepOptimizer(0.01, tolerance=0.005, cache=None, N_population=MADRID_N,
+                      days=500, **MADRID_RATES, **MADRID_CONFIG)
+        return None
+    return run
+
+@benchmark('modelOptimizerFromData Madrid heuristic')
+def _heuristicCalibrationCase():
+    from optimizers import modelOptimizerFromData
+    params0 = {'contagious_rate': 1.25, 'recovery_rate': 1./7, 'mortality_rate': 0.05}
+    def run():
+        modelOptimizerFromData(MADRID_N, params0, MADRID_DATA, h_max=0.01, 
+                               h_tolerance=0.05, data_tolerance=0.05, cache=None,
+                               graph=False)
+        return None
+    return run
+
+@benchmark('modelOptimizerFromData Madrid least_squares')
+def _leastSquaresCalibrationCase():
+    from optimizers import modelOptimizerFromData
+    params0 = {'contagious_rate': 1.25, 'recovery_rate': 1./7, 'mortality_rate': 0.05}
+    def run():
+        modelOptimizerFromData(MADRID_N, params0, MADRID_DATA, h_max=0.01,
+                               mode='least_squares', graph=False)
+        return None
+    return run
+
+@benchmark('getContagiousRate x1000')
+def _contagiousRateCase():
+    from fitData import getContagiousRate, COUNTRIES_DATA
+    detected = COUNTRIES_DATA['spain']
+    def run():
+        for _ in range(1000):
+            getContagiousRate(detected)
+        return 1000
+    return run
+
+@benchmark('loadJsonData 50 countries x 400 days')
+def _loadJsonCase():
+    from dataWebLoader import DataWebLoader
+    dates = [(date(2020, 2, 15) + timedelta(days=i)).strftime("%Y %m %d") 
+             for i in range(400)]
+    values = list(range(400))
+    content = dict(('country_{}'.format(k), 
+                    dict((name, (dates, values)) for name in ('Total Cases', 'Total Deaths',
+                                                              'Active Cases')))
+                   for k in range(50))
+    path = os.path.join(tempfile.mkdtemp(), 'data.json')
+    with open(path, 'w') as json_file:
+        json.dump(content, json_file)
+    def run():
+        DataWebLoader.loadJsonData(path)
+        return 50 * 3 * 400
+    return run
+
+def _measure(name, repeat):
+    """ Run a case (in a new process) and measure it.
+    Return:
+    :<dict> seconds (best of repeat), steps, steps_per_second, peak_rss_MB
+    """
+    run = BENCHMARKS[name]()
+    seconds, steps = np.inf, None
+    for _ in range(repeat):
+        t_0 = time.perf_counter()
+        steps = run()
+        seconds = min(seconds, time.perf_counter() - t_0)
+    # KB on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss /= 2**20 if platform.system() == 'Darwin' else 2**10
+    return {'seconds': seconds, 'steps': steps,
+            'steps_per_second': None if steps is None else steps / seconds,
+            'peak_rss_MB': peak_rss}
+
+def runBenchmarks(pattern='', repeat=3, save=None):
+    """
+    Run the cases of the suite with the pattern in their names, each one in
+    a new process (so the peak of resident memory is the one of the case).
+    Args:
+    :pattern (='' all) text in the names of the cases to run.
+    :repeat (=3) runs of each case, the time is the best one.
+    :save (optional) path of a json file to keep the results (with the 
+        versions of python and numpy), see compareBenchmarks.
+    
+    Return:
+    :<dict> name: <dict> with seconds, steps, steps_per_second, peak_rss_MB
+    """
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    print("{:55s} {:>10s} {:>14s} {:>10s}".format('benchmark', 'seconds', 
+                                                  'steps/s', 'RSS (MB)'))
+    for name in BENCHMARKS:
+        if pattern not in name:
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(_measure, name, repeat).result()
+        results[name] = result
+        steps_per_second = result['steps_per_second']
+        print("{:55s} {:10.4f} {:>14s} {:10.1f}".format(
+            name, result['seconds'], 
+            '-' if steps_per_second is None else '{:.4g}'.format(steps_per_second),
+            result['peak_rss_MB']))
+    if save:
+        with open(save, 'w') as json_file:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__,
+                       'date': time.strftime("%Y %m %d : %H"), 'results': results}, 
+                      json_file, indent=1)
+    return results
+
+def compareBenchmarks(previous, results, threshold=0.2):
+    """ Cases slower (or with more memory) than in a previous run by more 
+    than threshold (ratio).
+    Args:
+    :previous, path of a json saved by runBenchmarks.
+    :results <dict> of runBenchmarks.
+    Return:
+    :<list> of (name, quantity, previous value, value)
+    """
+    with open(previous) as json_file:
+        previous = json.load(json_file)['results']
+    regressions = []
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        for quantity in ('seconds', 'peak_rss_MB'):
+            if result[quantity] > (1 + threshold) * previous[name][quantity]:
+                regressions.append((name, quantity, previous[name][quantity], 
+                                    result[quantity]))
+    for name, quantity, value_prev, value in regressions:
+        print(f"REGRESSION {name}: {quantity} {value_prev:.4g} -> {value:.4g}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulations, '
+                                     'step optimization and calibrations.')
+    parser.add_argument('pattern', nargs='?', default='', 
+                        help='run only the cases with this text in the name')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='json file to save the results')
+    parser.add_argument('--compare', help='json file of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--backends', action='store_true', 
+                        help='compare the integration backends')
+    args = parser.parse_args()
+    if args.backends:
+        benchmarkBackends(args.repeat)
+    else:
+        results = runBenchmarks(args.pattern, args.repeat, args.save)
+        if args.compare:
+            compareBenchmarks(args.compare, results, args.threshold)
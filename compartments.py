@@ -0,0 +1,433 @@
+'''
+Created on 18 oct. 2026
+
+@author: Miguel
+'''
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from disease import DiseaseSimulation, dormandPrince, hermiteInterpolation, growRows
+
+# =============================================================================
+#   COMPARTMENT GRAPH
+# =============================================================================
+# Flux of people from the source compartment to the target one:
+#     rate * y[source]                                    (infectious=None)
+#     rate * y[source] * sum(y[infectious]) / N_population (mass action)
+Transition = namedtuple('Transition', 'source target rate infectious')
+
+
+class CompartmentModel(object):
+    """
+    Model given by its compartments and the transitions between them,
+    compiled into a stoichiometry matrix (one row per transition) so the
+    derivatives of every compartment are computed with a few array
+    operations, for one state (n_compartments, ) or many (..., n_compartments).
+    The groups sum several compartments (f.e. the stages of the infected).
+    """
+
+    def __init__(self, compartments, transitions, groups=None):
+        """
+        Args:
+        :compartments <tuple> names of the compartments.
+        :transitions <list> of Transition (names of the compartments).
+        :groups <dict> (optional) name: tuple of compartments, every
+            compartment is also a group of itself.
+        """
+        self.compartments = tuple(compartments)
+        self.transitions = list(transitions)
+        self.index = dict((name, j) for j, name in enumerate(self.compartments))
+        for transition in self.transitions:
+            for name in (transition.source, transition.target) + tuple(transition.infectious or ()):
+                assert name in self.index, \
+                    "unknown compartment '{}' in {}".format(name, transition)
+        self.groups = dict((name, (name, )) for name in self.compartments)
+        self.groups.update(groups or {})
+        self.__compile()
+
+    def __compile(self):
+        n_c, n_t = len(self.compartments), len(self.transitions)
+        self.stoichiometry = np.zeros((n_t, n_c))
+        self.sources = np.empty(n_t, dtype=int)
+        self.targets = np.empty(n_t, dtype=int)
+        self.rates = np.empty(n_t)
+        for t, transition in enumerate(self.transitions):
+            self.sources[t] = self.index[transition.source]
+            self.targets[t] = self.index[transition.target]
+            self.stoichiometry[t, self.sources[t]] -= 1
+            self.stoichiometry[t, self.targets[t]] += 1
+            self.rates[t] = transition.rate
+        # infectious compartments of the transition t (scalar loop):
+        # infectious_index[infectious_ptr[t]:infectious_ptr[t + 1]]
+        infectious = [[self.index[name] for name in transition.infectious or ()]
+                      for transition in self.transitions]
+        self.infectious_ptr = np.cumsum([0] + [len(names) for names in infectious])
+        self.infectious_index = np.array(sum(infectious, []), dtype=int)
+        # infectious compartments (rows) of each infection (columns)
+        self.infections = np.array([t for t, transition in enumerate(self.transitions)
+                                    if transition.infectious], dtype=int)
+        self.contacts = np.zeros((n_c, len(self.infections)))
+        for k, t in enumerate(self.infections):
+            for name in self.transitions[t].infectious:
+                self.contacts[self.index[name], k] = 1
+
+    def __repr__(self):
+        return "CompartmentModel({}, {} transitions)".format(
+            '-'.join(self.compartments), len(self.transitions))
+
+    def derivatives(self, state, N_population, rates=None):
+        """
+        Time derivatives of the compartments.
+        Args:
+        :state <array> (..., n_compartments)
+        :N_population
+        :rates (optional) <array> broadcastable to (..., n_transitions), by
+            default the ones of the transitions.
+
+        Return:
+        :<array> with the same shape than state.
+        """
+        state = np.asarray(state, dtype=float)
+        rates = self.rates if rates is None else rates
+        fluxes = rates * state[..., self.sources]
+        if len(self.infections):
+            fluxes[..., self.infections] *= (state @ self.contacts) / N_population
+        return fluxes @ self.stoichiometry
+
+    def groupIndexes(self, group):
+        """ Indexes of the compartments of a group. """
+        return [self.index[name] for name in self.groups[group]]
+
+# =============================================================================
+#   MODELS
+# =============================================================================
+
+def epidemicModel(contagious_rate, recovery_rate, mortality_rate=0.0,
+                  incubation_rate=None, immunity_loss_rate=0.0,
+                  vaccination_rate=0.0, groups_of_recovery=1):
+    """
+    Compartments of the SIR(D) model of DiseaseSimulation, with the options:
+    Args:
+    :contagious_rate, recovery_rate, mortality_rate, as in DiseaseSimulation.
+    :incubation_rate (optional) 1 / days of incubation, exposed (E) people
+        infected but not infectious yet (SEIR).
+    :immunity_loss_rate (=0) 1 / days of immunity, from R to S (SEIRS).
+    :vaccination_rate (=0) ratio of the susceptible vaccinated each day (V).
+    :groups_of_recovery (=1) number of stages of the infected (I1 ... Ik),
+        with k*(recovery_rate + mortality_rate) between them, so the period
+        of infection has an Erlang distribution with the same mean.
+
+    Return:
+    :CompartmentModel with the groups 'susceptible', 'exposed', 'infected',
+        'recovered', 'dead' and 'vaccinated'.
+    """
+    k = groups_of_recovery
+    assert k >= 1, "groups_of_recovery must be >= 1, got {}".format(k)
+    infected = ('I', ) if k == 1 else tuple('I{}'.format(j + 1) for j in range(k))
+    compartments = ('S', ) + (('E', ) if incubation_rate else ()) + infected + ('R', 'D')
+
+    transitions = [Transition('S', compartments[1], contagious_rate, infected)]
+    if incubation_rate:
+        transitions.append(Transition('E', infected[0], incubation_rate, None))
+    for stage, next_stage in zip(infected[:-1], infected[1:]):
+        transitions.append(Transition(stage, next_stage,
+                                      k * (recovery_rate + mortality_rate), None))
+    transitions.append(Transition(infected[-1], 'R', k * recovery_rate, None))
+    transitions.append(Transition(infected[-1], 'D', k * mortality_rate, None))
+    if immunity_loss_rate:
+        transitions.append(Transition('R', 'S', immunity_loss_rate, None))
+    if vaccination_rate:
+        compartments += ('V', )
+        transitions.append(Transition('S', 'V', vaccination_rate, None))
+
+    groups = {'susceptible': ('S', ),
+              'exposed'    : ('E', ) if incubation_rate else (),
+              'infected'   : infected,
+              'recovered'  : ('R', ),
+              'dead'       : ('D', ),
+              'vaccinated' : ('V', ) if vaccination_rate else ()}
+    return CompartmentModel(compartments, transitions, groups)
+
+def sirModel(contagious_rate, recovery_rate, mortality_rate=0.0, groups_of_recovery=1):
+    return epidemicModel(contagious_rate, recovery_rate, mortality_rate,
+                         groups_of_recovery=groups_of_recovery)
+
+def seirModel(contagious_rate, incubation_rate, recovery_rate, mortality_rate=0.0,
+              groups_of_recovery=1):
+    return epidemicModel(contagious_rate, recovery_rate, mortality_rate,
+                         incubation_rate=incubation_rate,
+                         groups_of_recovery=groups_of_recovery)
+
+def seirsModel(contagious_rate, incubation_rate, recovery_rate, immunity_loss_rate,
+               mortality_rate=0.0, groups_of_recovery=1):
+    return epidemicModel(contagious_rate, recovery_rate, mortality_rate,
+                         incubation_rate=incubation_rate,
+                         immunity_loss_rate=immunity_loss_rate,
+                         groups_of_recovery=groups_of_recovery)
+
+# =============================================================================
+#   SIMULATION
+# =============================================================================
+
+def compartmentEulerLoop(states, h_rates, sources, targets, infectious_ptr,
+                         infectious_index, N_population):
+    """
+    Explicit Euler steps of a block (in place) for a CompartmentModel: rows
+    1: of states from the first one, each compartment kept in 
+    [0.01, N_population] (as disease.eulerLoop). Plain scalar code, compiled
+    by Numba if it is installed (compartmentEulerLoopCompiled).
+    Args:
+    :states <array> (n, n_compartments) with the initial state in the first row.
+    :h_rates, t_step * rate of each transition.
+    :sources, targets, infectious_ptr, infectious_index, of the CompartmentModel.
+    """
+    N = N_population
+    n_c = states.shape[1]
+    y = [states[0, j] for j in range(n_c)]
+    dy = [0.0] * n_c
+    for k in range(1, len(states)):
+        for j in range(n_c):
+            dy[j] = 0.0
+        for t in range(len(h_rates)):
+            flux = h_rates[t] * y[sources[t]]
+            if infectious_ptr[t + 1] > infectious_ptr[t]:
+                contacts = 0.0
+                for m in range(infectious_ptr[t], infectious_ptr[t + 1]):
+                    contacts += y[infectious_index[m]]
+                flux *= contacts / N
+            dy[sources[t]] -= flux
+            dy[targets[t]] += flux
+        for j in range(n_c):
+            y[j] = max(min(N, y[j] + dy[j]), 0.01)
+            states[k, j] = y[j]
+
+# Compiled version of the loop (None if Numba is not installed)
+compartmentEulerLoopCompiled = (None if numba is None 
+                                else numba.njit(cache=True)(compartmentEulerLoop))
+
+
+class CompartmentSimulation(object):
+    """
+    Integration of a CompartmentModel from day_0 to day_0 + days, with the
+    explicit Euler method (fixed t_step, a scalar loop over the transitions
+    as the one of the 'numba' backend of DiseaseSimulation, compiled if Numba 
+    is installed) or the adaptive Dormand-Prince 5(4) ('rk45'). The results
+    are a (n, n_compartments) array, and the groups (susceptible, infected,
+    recovered, dead ...) are sums of its columns.
+    """
+    METHOD_EULER = 'euler'
+    METHOD_RK45  = 'rk45'
+    METHODS = (METHOD_EULER, METHOD_RK45)
+    EULER_BLOCK = DiseaseSimulation.EULER_BLOCK
+    RK45_BLOCK  = DiseaseSimulation.RK45_BLOCK
+
+    def __init__(self, model, N_population=200000, initial=None, t_step=0.01,
+                 days=200, day_0=0, method=METHOD_EULER, atol=1e-3, rtol=1e-6,
+                 output_every=None, stop_when_extinct=True):
+        """
+        Args:
+        :model CompartmentModel
+        :initial <dict> (optional) people in each compartment at day_0 (the
+            rest are susceptible 'S'), by default 1 in the first infected
+            stage.
+        :t_step, days, method, atol, rtol, as in DiseaseSimulation.
+        :output_every (optional) keep only the states every output_every days
+            (interpolated inside the steps).
+        :stop_when_extinct (=True) stop before day_0 + days when the infected
+            drop below a person after their maximum (as DiseaseSimulation, 
+            which also continues after days until then).
+        """
+        assert method in self.METHODS, \
+            "method must be one of {}, got '{}'".format(self.METHODS, method)
+        self.model = model
+        self.N_population = N_population
+        self.t_step, self.days, self.day_0 = t_step, days, day_0
+        self.method, self.atol, self.rtol = method, atol, rtol
+        self.output_every = output_every
+        self.stop_when_extinct = stop_when_extinct
+        self.converged = False
+
+        if initial is None:
+            initial = {model.groups['infected'][0]: 1}
+        self.initial_state = np.zeros(len(model.compartments))
+        for name, value in initial.items():
+            self.initial_state[model.index[name]] = value
+        self.initial_state[model.index['S']] = N_population - sum(
+            value for name, value in initial.items() if name != 'S')
+
+        self._trajectory = self.initial_state[np.newaxis].copy()
+        self._time = np.array([float(day_0)])
+        self._n = 1
+
+    @classmethod
+    def fromDiseaseSimulation(cls, ds, **kwargs):
+        """ Simulation with the rates, initial values, step and days of a
+        DiseaseSimulation object, and its GROUPS_OF_RECOVERY stages of the
+        infected. """
+        assert ds.contagious_schedule is None, \
+            "the compartment models take a constant contagious_rate, got a schedule"
+        model = sirModel(ds.CONT_FACTOR, ds.RECO_RATE, ds.MORTALITY,
+                         groups_of_recovery=ds.GROUPS_OF_RECOVERY)
+        s_0, i_0, r_0, d_0 = ds.initial_state
+        initial = {model.groups['infected'][0]: i_0, 'R': r_0, 'D': d_0}
+        kwargs = {'t_step': ds.t_step, 'days': ds.days, 'day_0': ds.DAY_0,
+                  'method': ds.method, **kwargs}
+        return cls(model, ds.N_population, initial, **kwargs)
+
+    # =========================================================================
+    #   RESULTS
+    # =========================================================================
+    @property
+    def time(self):
+        return self._time[:self._n]
+
+    @property
+    def trajectory(self):
+        """ <array> (n, n_compartments) """
+        return self._trajectory[:self._n]
+
+    def group(self, name):
+        """ Sum of the compartments of a group for every stored state. """
+        return self.trajectory[:, self.model.groupIndexes(name)].sum(axis=1)
+
+    susceptible = property(lambda self: self.group('susceptible'))
+    infected    = property(lambda self: self.group('infected'))
+    recovered   = property(lambda self: self.group('recovered'))
+    dead        = property(lambda self: self.group('dead'))
+
+    @property
+    def max_infected(self):
+        """ (day, infected) of the stored state with most infected. """
+        infected = self.infected
+        i = int(np.argmax(infected))
+        return (round(float(self.time[i]), 2), round(float(infected[i])))
+
+    def getResults(self):
+        """ list of tuples: (day, SUSCEPTIBLE, INFECTED, RECOVERED, DEAD) """
+        return zip(self.time, self.susceptible, self.infected,
+                   self.recovered, self.dead)
+
+    # =========================================================================
+    #   INTEGRATION
+    # =========================================================================
+    def __eulerBlocks(self):
+        """ Euler integration in blocks of EULER_BLOCK steps (the loop of the 
+        steps compiled if Numba is installed).
+        Yield:
+        :(times, states, derivatives) of each block, the first row is the 
+            last one of the previous block (the arrays are reused).
+        """
+        model, N, h = self.model, self.N_population, self.t_step
+        compiled = compartmentEulerLoopCompiled is not None
+        loop = compartmentEulerLoopCompiled if compiled else compartmentEulerLoop
+        arrays = (h * model.rates, model.sources, model.targets, 
+                  model.infectious_ptr, model.infectious_index)
+        if not compiled:
+            arrays = [array.tolist() for array in arrays]
+        n_steps = int(round(self.days / h))
+        states = np.empty((max(1, min(n_steps, self.EULER_BLOCK)) + 1, 
+                           len(self.initial_state)))
+        states[0] = self.initial_state
+        i_ini = 0
+        while i_ini < n_steps:
+            block = states[:min(len(states) - 1, n_steps - i_ini) + 1]
+            loop(block, *arrays, N)
+            yield (self.day_0 + h * np.arange(i_ini, i_ini + len(block)), block,
+                   model.derivatives(block, N))
+            i_ini += len(block) - 1
+            states[0] = block[-1]
+
+    def __adaptiveBlocks(self):
+        """ Dormand-Prince 5(4) steps until day_0 + days, in blocks of 
+        RK45_BLOCK steps (as __eulerBlocks). """
+        N, model = self.N_population, self.model
+        t_end = self.day_0 + self.days
+        f = lambda t, y: model.derivatives(y, N)
+        steps = dormandPrince(f, self.day_0, self.initial_state, 
+                              self.atol, self.rtol, h=self.t_step)
+        block = [(self.day_0, self.initial_state, f(self.day_0, self.initial_state))]
+        while block[-1][0] < t_end:
+            for step in islice(steps, self.RK45_BLOCK):
+                block.append(step)
+                if step[0] >= t_end:
+                    break
+            yield tuple(map(np.array, zip(*block)))
+            block = block[-1:]
+
+    def __extinctionRow(self, times, states, derivatives):
+        """ Row of a block where the infected drop below a person after their
+        maximum (None if they do not), with the criteria of the events of 
+        the 'numpy' backend of DiseaseSimulation. """
+        infected_indexes = self.model.groupIndexes('infected')
+        infected = states[:, infected_indexes].sum(axis=1)
+        if self._t_peak is None:
+            d_infected = derivatives[:, infected_indexes].sum(axis=1)
+            if (times[0] == self.day_0) and (d_infected[0] <= 0):
+                self._t_peak = times[0]
+            else:
+                crossing = np.flatnonzero((d_infected[:-1] > 0) & (d_infected[1:] <= 0))
+                if crossing.size == 0:
+                    return None
+                self._t_peak = times[crossing[0]]
+        g = infected - 1
+        crossing = (g[:-1] > 0) & (g[1:] <= 0)
+        if self._t_peak == self.day_0:
+            crossing |= (g[:-1] >= 0) & (g[1:] < 0)
+        crossing = np.flatnonzero(crossing & (times[1:] > self._t_peak))
+        return None if crossing.size == 0 else crossing[0] + 1
+
+    def __call__(self):
+        """ Run the integration and store the states (until day_0 + days, or
+        the extinction of the infected if stop_when_extinct). """
+        n_rows = (int(self.days / self.output_every) + 1 if self.output_every
+                  else int(round(self.days / self.t_step)) + 1)
+        self._trajectory = np.empty((n_rows, len(self.initial_state)))
+        self._time = np.empty(n_rows)
+        self._trajectory[0], self._time[0] = self.initial_state, self.day_0
+        self._n = 1
+        self._t_peak = None
+        self.converged = False
+
+        t_end = self.day_0 + self.days
+        t_next = self.day_0 + (self.output_every or 0)
+        blocks = (self.__adaptiveBlocks() if self.method == self.METHOD_RK45 
+                  else self.__eulerBlocks())
+        for times, states, derivatives in blocks:
+            i_last = None
+            if self.stop_when_extinct:
+                i_last = self.__extinctionRow(times, states, derivatives)
+            if i_last is not None:
+                self.converged = True
+                times, states, derivatives = (times[:i_last + 1], states[:i_last + 1], 
+                                              derivatives[:i_last + 1])
+            if not self.output_every:
+                self.__store(times[1:], states[1:])
+            else:
+                # Hermite interpolation inside the steps of the block
+                t_last = min(times[-1], t_end) + 1e-9 * self.output_every
+                n_out = int(np.floor((t_last - t_next) / self.output_every)) + 1
+                if n_out > 0:
+                    t_out = t_next + self.output_every * np.arange(n_out)
+                    k = np.clip(np.searchsorted(times, t_out) - 1, 0, len(times) - 2)
+                    x = t_out[:, np.newaxis]
+                    self.__store(t_out, hermiteInterpolation(
+                        x, times[k][:, np.newaxis], times[k + 1][:, np.newaxis],
+                        states[k], states[k + 1], derivatives[k], derivatives[k + 1]))
+                    t_next = t_out[-1] + self.output_every
+            if self.converged:
+                return
+
+    def __store(self, times, states):
+        n_new = self._n + len(times)
+        if n_new > len(self._trajectory):
+            self._trajectory = growRows(self._trajectory, n_new)
+            self._time = growRows(self._time, len(self._trajectory))
+        self._trajectory[self._n : n_new] = states
+        self._time[self._n : n_new] = times
+        self._n = n_new
@@ -6,9 +6,12 @@ Created on 31 mar. 2020
 
 import re
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
 from copy import deepcopy
 import json
+import threading
+import time
 
 TEMPLATE = "Highcharts.chart({}, "
 GRAPHS = {'Total Cases' : "'coronavirus-cases-{}'", 
@@ -35,6 +38,17 @@ class DataWebLoader(object):
     URL = "https://www.worldometers.info/coronavirus/country/{}/"
     JSON_PATH = "data.json"
     TIMESTAMP = "DOWNLOADED TIMESTAMP"
+    # Concurrent downloads of getData
+    MAX_WORKERS = 8       # countries downloaded at once (and connections kept)
+    RETRIES     = 3       # for connection errors and 429/5xx responses
+    BACKOFF     = 0.5     # seconds, doubled in each retry
+    TIMEOUT     = 30      # seconds for each request
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    
+    @staticmethod
+    def countryList(countries):
+        """ countries <str> or list <str> to a list <str> """
+        return [countries] if isinstance(countries, str) else list(countries)
     
     @staticmethod
     def getDataScrapper(countries='spain', save=False, download_anyway=False):
@@ -50,6 +64,7 @@ class DataWebLoader(object):
             (datetime.date list, int list)
         """
         # avoid unnecessary downloads
+        countries = DataWebLoader.countryList(countries)
         if (not download_anyway) and DataWebLoader.__loadValuesJson(countries):
             return DataWebLoader.loadJsonData()
             
@@ -58,7 +73,7 @@ class DataWebLoader(object):
         driver = webdriver.Chrome(DataWebLoader.CHROMIUM_PATH)
         
         resultDict = {}
-        countries = countries if isinstance(countries, list) else list(countries)
+        countries = DataWebLoader.countryList(countries)
         print(" Data Scrapper Started ",
               "--------------------------------------------------------")
         for country in countries:
@@ -78,37 +93,87 @@ class DataWebLoader(object):
         return resultDict
     
     @staticmethod
-    def getData(countries='spain', save=False, download_anyway=False):
+    def session(max_workers=None, retries=None, backoff=None):
+        """ requests.Session for the downloads: keeps alive a connection for
+        each worker and retries (with exponential backoff) the failed 
+        connections and the RETRY_STATUS responses. """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        max_workers = max_workers or DataWebLoader.MAX_WORKERS
+        retry = Retry(total=DataWebLoader.RETRIES if retries is None else retries,
+                      backoff_factor=DataWebLoader.BACKOFF if backoff is None else backoff,
+                      status_forcelist=DataWebLoader.RETRY_STATUS,
+                      allowed_methods=('GET', ), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    @staticmethod
+    def __downloadCountry(session, url, country, timeout):
+        """ Download and process the page of a country (in a worker thread).
+        Return:
+        :<dict> with the data of each table, None if the download failed.
         """
+        import requests
+        try:
+            response = session.get(url.format(country), timeout=timeout)
+        except requests.RequestException as error:
+            print("Error while connecting to {}: {}".format(url.format(country), error))
+            return None
+        if not response.ok:
+            print("Error while connecting to {}: exit with status code {}/{}"
+                  .format(response.url, response.status_code, response.reason))
+            return None
+        print("processing data from: ", response.url)
+        return DataWebLoader.__loadHtmlAndProcess(response.text)
+    
+    @staticmethod
+    def getData(countries='spain', save=False, download_anyway=False,
+                max_workers=None, url=None, retries=None, backoff=None, timeout=None):
+        """
+        Download the countries concurrently, max_workers at once sharing a
+        session (keep-alive connections and retries, see session()), each 
+        page is processed in the thread that downloads it.
         Args: 
         :countries <str> or list <str>, for the country names in the web
             (spain, italy, us, germany, uk ... see the web).
         :download_anyway <bool> download from the web whenever you have already 
             download the data that day or not.
+        :max_workers (=MAX_WORKERS) downloads at once.
+        :url (=URL) template of the pages with {} for the country, f.e. a 
+            local server with saved pages 'http://localhost:8000/{}.html'.
+        :retries (=RETRIES), backoff (=BACKOFF), timeout (=TIMEOUT) of the 
+            requests.
         Return:
         :coutry data (dict) with the data for each table in tuples:
             (datetime.date list, int list)
         """
         # avoid unnecessary downloads
+        countries = DataWebLoader.countryList(countries)
         if (not download_anyway) and DataWebLoader.__loadValuesJson(countries):
             return DataWebLoader.loadJsonData()
-            
-        import requests
+        
+        url = url or DataWebLoader.URL
+        timeout = timeout or DataWebLoader.TIMEOUT
+        max_workers = max_workers or DataWebLoader.MAX_WORKERS
         
         resultDict = {}
-        countries = countries if isinstance(countries, list) else list(countries)
         print(" Data Download Started ",
               "--------------------------------------------------------")
-        for country in countries:
-            response = requests.get(DataWebLoader.URL.format(country))
-            if not response.ok:
-                print("Error while connecting to {}: exit with status code {}/{}"
-                      .format(response.url, response.status_code, response.reason))
-                continue
-            print("processing data from: ", response.url)
-            dict_values = DataWebLoader.__loadHtmlAndProcess(response.text)
-            
-            resultDict[country] = dict_values
+        with DataWebLoader.session(max_workers, retries, backoff) as session, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda country: DataWebLoader.__downloadCountry(session, url, 
+                                                                country, timeout),
+                countries)
+            for country, dict_values in zip(countries, results):
+                if dict_values is not None:
+                    resultDict[country] = dict_values
         
         if save:
             DataWebLoader.save(resultDict)
@@ -129,9 +194,11 @@ class DataWebLoader(object):
         
         for match in matchs:
             if match.attrs and match.attrs.get('type') == 'text/javascript':
+                # (the text of the scripts is empty for recent BeautifulSoup)
+                text = str(match.string or '')
                 for title in GRAPHS:
-                    if title in match.text:
-                        html_dict[title] = str(match.text)
+                    if title in text:
+                        html_dict[title] = text
         
         return DataWebLoader.__processHtmlJavaScriptCharts(html_dict)
     
@@ -222,5 +289,111 @@ class DataWebLoader(object):
                 
                 resultDict[country][name] = (dates, vals)
         return resultDict
+
+
+# =============================================================================
+#   OFFLINE CHECK
+# =============================================================================
+# Page of a country with the scripts of the charts as in the web (linear and
+# log charts of the totals, active cases)
+TEST_PAGE = """<html><head><title>{country}</title></head><body>
+<script type="text/javascript">
+Highcharts.chart('coronavirus-cases-linear', {{ title: {{ text: 'Total Cases' }},
+    xAxis: {{ categories: [{dates}] }}, series: [{{ name: 'Cases', data: [{cases}] }}] }});
+Highcharts.chart('coronavirus-cases-log', {{ title: {{ text: 'Total Cases (log)' }},
+    xAxis: {{ categories: [{dates}] }}, series: [{{ name: 'Cases', data: [{cases}] }}] }});
+</script>
+<script type="text/javascript">
+Highcharts.chart('coronavirus-deaths-linear', {{ title: {{ text: 'Total Deaths' }},
+    xAxis: {{ categories: [{dates}] }}, series: [{{ name: 'Deaths', data: [{deaths}] }}] }});
+Highcharts.chart('coronavirus-deaths-log', {{ title: {{ text: 'Total Deaths (log)' }},
+    xAxis: {{ categories: [{dates}] }}, series: [{{ name: 'Deaths', data: [{deaths}] }}] }});
+</script>
+<script type="text/javascript">
+Highcharts.chart('graph-active-cases-total', {{ title: {{ text: 'Active Cases' }},
+    xAxis: {{ categories: [{dates}] }}, series: [{{ name: 'Active', data: [{active}] }}] }});
+</script>
+</body></html>"""
+
+def offlineCheck(countries=('spain', 'italy', 'germany', 'france'), delay=0.2):
+    """
+    Run getData against a local http.server with a TEST_PAGE for each 
+    country: the first request of 'flaky' answers 503 (it has to be retried),
+    'missing' answers 404 (it has to be skipped), and every page is answered
+    after delay seconds (the downloads have to overlap).
+    Return:
+    :<dict> of getData
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    
+    dates = [date(2020, 3, 1 + day) for day in range(10)]
+    tables = {'Total Cases' : [10 * 2**day for day in range(10)],
+              'Total Deaths': [2**day for day in range(10)],
+              'Active Cases': [8 * 2**day for day in range(10)]}
+    page = TEST_PAGE.format(
+        country='{country}',
+        dates=','.join('"{}"'.format(day.strftime('%b %d')) for day in dates),
+        cases=','.join(map(str, tables['Total Cases'])),
+        deaths=','.join(map(str, tables['Total Deaths'])),
+        active=','.join(map(str, tables['Active Cases'])))
+    
+    lock = threading.Lock()
+    requested = dict((country, 0) for country in countries + ('flaky', 'missing'))
+    running = {'now': 0, 'max': 0}
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            country = self.path.strip('/').split('.')[0]
+            with lock:
+                requested[country] = requested.get(country, 0) + 1
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+                first = requested[country] == 1
+            try:
+                time.sleep(delay)
+                if (country == 'missing') or (country not in requested):
+                    self.send_error(404)
+                elif (country == 'flaky') and first:
+                    self.send_error(503)
+                else:
+                    body = page.replace('{country}', country).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+            finally:
+                with lock:
+                    running['now'] -= 1
         
-    
\ No newline at end of file
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = 'http://127.0.0.1:{}/{{}}.html'.format(server.server_address[1])
+        asked = list(countries) + ['flaky', 'missing']
+        resultDict = DataWebLoader.getData(asked, download_anyway=True, url=url,
+                                           backoff=0, max_workers=len(asked))
+    finally:
+        server.shutdown()
+        server.server_close()
+    
+    assert list(resultDict) == list(countries) + ['flaky'], \
+        "expected {} and 'flaky', got {}".format(countries, list(resultDict))
+    for country, dict_values in resultDict.items():
+        for title, values in tables.items():
+            assert dict_values[title] == (dates, values), \
+                "wrong '{}' of {}: {}".format(title, country, dict_values[title])
+    assert requested['flaky'] == 2, \
+        "'flaky' requested {} times, expected 2".format(requested['flaky'])
+    assert requested['missing'] == 1, "'missing' (404) must not be retried"
+    assert running['max'] > 1, "the downloads did not overlap"
+    print("OFFLINE CHECK OK: {} countries, {} requests, {} at once".format(
+        len(resultDict), sum(requested.values()), running['max']))
+    return resultDict
+
+
+if __name__ == '__main__':
+    offlineCheck()
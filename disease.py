@@ -6,6 +6,13 @@ Created on Fri Mar 14 11:08:42 2020
 """
 
 import numpy as np
+from collections import namedtuple
+from itertools import islice
+import threading
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # =============================================================================
 #   ODE SOLVERS
@@ -18,26 +25,329 @@ def euler(x_i, f_i, h):
 def dydx(x, y): 
     return ((x - y)/2) 
 
-def rungeKutta4(x0, y0, x, h): 
+def rungeKuttaStages(f, x, y, h, c, a, k_1=None):
+    """ Stages k_i = f(x + c_i*h, y + h*sum_j(a_ij*k_j)) of an explicit Runge
+    Kutta method given by its Butcher tableau (c nodes, a matrix). The first 
+    stage can be given if it is known (First Same As Last methods). """
+    k = [f(x, y) if k_1 is None else k_1]
+    for c_i, a_i in zip(c[1:], a[1:]):
+        k.append(f(x + c_i*h, y + h*sum(a_ij*k_j for a_ij, k_j in zip(a_i, k))))
+    return k
+
+# Butcher tableau of the classic Runge Kutta of order 4
+RK4_C = (0., 1/2, 1/2, 1.)
+RK4_A = ((), (1/2,), (0., 1/2), (0., 0., 1.))
+RK4_B = (1/6, 1/3, 1/3, 1/6)
+
+def rungeKutta4Step(f, x, y, h):
+    k = rungeKuttaStages(f, x, y, h, RK4_C, RK4_A)
+    return y + h*sum(b_i*k_i for b_i, k_i in zip(RK4_B, k))
+
+def rungeKutta4(x0, y0, x, h, f=dydx): 
     # Count number of iterations using step size or 
     # step height h 
     n = (int)((x - x0)/h)  
     # Iterate for number of iterations 
     y = y0 
     for i in range(1, n + 1): 
-        k1 = h * dydx(x0, y) 
-        k2 = h * dydx(x0 + 0.5 * h, y + 0.5 * k1) 
-        k3 = h * dydx(x0 + 0.5 * h, y + 0.5 * k2) 
-        k4 = h * dydx(x0 + h, y + k3) 
-  
         # Update next value of y 
-        y = y + (1.0 / 6.0)*(k1 + 2 * k2 + 2 * k3 + k4) 
+        y = rungeKutta4Step(f, x0, y, h)
   
         # Update next value of x 
         x0 = x0 + h 
     return y 
+
+# Butcher tableau of Dormand-Prince 5(4), the 7th stage is evaluated at the
+# 5th order solution, so it is the first stage of the next step.
+DP_C = (0., 1/5, 3/10, 4/5, 8/9, 1., 1.)
+DP_A = ((),
+        (1/5,),
+        (3/40, 9/40),
+        (44/45, -56/15, 32/9),
+        (19372/6561, -25360/2187, 64448/6561, -212/729),
+        (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+        (35/384, 0., 500/1113, 125/192, -2187/6784, 11/84))
+DP_B5 = (35/384, 0., 500/1113, 125/192, -2187/6784, 11/84, 0.)
+DP_B4 = (5179/57600, 0., 7571/16695, 393/640, -92097/339200, 187/2100, 1/40)
+
+def dormandPrinceStep(f, x, y, h, k_1=None):
+    """ 
+    One step of the embedded Runge Kutta 5(4) of Dormand-Prince.
+    Return:
+    :<tuple> (y of 5th order, error estimation (5th - 4th order), 
+              derivative at the new point (k_1 of the next step))
+    """
+    k = rungeKuttaStages(f, x, y, h, DP_C, DP_A, k_1)
+    y_new = y + h*sum(b_i*k_i for b_i, k_i in zip(DP_B5, k))
+    error = h*sum((b5 - b4)*k_i for b5, b4, k_i in zip(DP_B5, DP_B4, k))
+    return y_new, error, k[-1]
+
+def dormandPrince(f, x0, y0, atol=1e-6, rtol=1e-6, h=None):
+    """
+    Adaptive integration of dy/dx = f(x, y) with error control: a step is 
+    accepted when the estimated error is under atol + rtol*|y| (rms norm), 
+    and the next step size is adapted from the error of the last one.
+    Args:
+    :x0, y0 initial point (y0 could be a numpy array).
+    :atol, rtol absolute and relative tolerances.
+    :h (optional) first step to try, estimated from f(x0, y0) otherwise.
+    
+    Yield:
+    :<tuple> (x, y, dy/dx) for each accepted step, the caller decides when to
+        stop the iteration.
+    """
+    x, y = x0, np.asarray(y0, dtype=float)
+    dy = f(x, y)
+    if h is None:
+        scale = atol + rtol*np.abs(y)
+        d_0, d_1 = np.sqrt(np.mean((y / scale)**2)), np.sqrt(np.mean((dy / scale)**2))
+        h = 0.01 * d_0 / d_1 if min(d_0, d_1) > 1e-5 else 1e-6
+    while True:
+        y_new, error, dy_new = dormandPrinceStep(f, x, y, h, dy)
+        scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+        err_norm = np.sqrt(np.mean((error / scale)**2))
+        if err_norm <= 1.0:
+            x, y, dy = x + h, y_new, dy_new
+            yield x, y, dy
+        # Step size controller (order 5 -> exponent 1/5), with safety factor
+        h *= min(5.0, max(0.2, 0.9 * err_norm**(-0.2) if err_norm > 0 else 5.0))
+
+def hermiteInterpolation(x, x0, x1, y0, y1, dy0, dy1):
+    """ Cubic Hermite interpolation inside the step [x0, x1] from the values 
+    and the derivatives at both ends (dense output of the step). """
+    h = x1 - x0
+    u = (x - x0) / h
+    return ((1 + 2*u)*(1 - u)**2 * y0 + u*(1 - u)**2 * h*dy0
+            + u**2*(3 - 2*u) * y1 + u**2*(u - 1) * h*dy1)
+
+def locateEvent(g, x0, x1, y0, y1, dy0, dy1, xtol=1e-10):
+    """
+    Root of the event function g(x, y(x)) in the step [x0, x1] where g changes
+    its sign, y(x) being the Hermite interpolation of the step. Solved with 
+    regula falsi (Illinois variant).
+    Return:
+    :<tuple> (x, y(x)) of the event.
+    """
+    a, b = x0, x1
+    g_a, g_b = g(x0, y0), g(x1, y1)
+    x, y, side = x1, y1, 0
+    for _ in range(100):
+        x = (a*g_b - b*g_a) / (g_b - g_a)
+        y = hermiteInterpolation(x, x0, x1, y0, y1, dy0, dy1)
+        g_x = g(x, y)
+        if g_x * g_b > 0:
+            b, g_b = x, g_x
+            if side == -1:
+                g_a /= 2
+            side = -1
+        elif g_x * g_a > 0:
+            a, g_a = x, g_x
+            if side == 1:
+                g_b /= 2
+            side = 1
+        else:
+            break
+        if abs(b - a) < xtol * max(1.0, abs(x)):
+            break
+    return x, y
+
+# =============================================================================
+#   VECTORIZED SIR SYSTEM
+# =============================================================================
+# Each row is one of the fluxes of the model (infection, recovery, death) and
+# each column the change it produces on (S, I, R, D).
+SIR_STOICHIOMETRY = np.array([[-1., 1., 0., 0.],
+                              [ 0.,-1., 1., 0.],
+                              [ 0.,-1., 0., 1.]])
+
+def sirDerivatives(state, cont_rate, reco_rate, mortality):
+    """ 
+    Time derivatives of the SIR model for one or many states at once.
+    Args:
+    :state <array> with shape (..., 4) ordered as (S, I, R, D).
+    :cont_rate, reco_rate, mortality, scalars or arrays broadcastable to 
+        state.shape[:-1] (CONT_RATE is already divided by N_population).
     
+    Return:
+    :<array> with the same shape than state.
+    """
+    state  = np.asarray(state, dtype=float)
+    fluxes = np.empty(state.shape[:-1] + (3,))
+    fluxes[..., 0] = cont_rate * state[..., 0]
+    fluxes[..., 1] = reco_rate
+    fluxes[..., 2] = mortality
+    fluxes *= state[..., 1:2]
+    return fluxes @ SIR_STOICHIOMETRY
+
+def sirSensitivityDerivatives(state, sensitivity, cont_rate, reco_rate, 
+                              mortality, N_population, segment=0):
+    """
+    Time derivatives of the sensitivities of (S, I, R, D) to the rates
+    (contagious_rate, recovery_rate, mortality_rate), the forward sensitivity
+    system dZ/dt = J_state * Z + J_rates (Z = 0 at the start, the initial 
+    values do not depend on the rates).
+    Args:
+    :state <array> with shape (..., 4) ordered as (S, I, R, D).
+    :sensitivity <array> with shape (..., 4, n_rates), Z[j, k] = d state_j / d rate_k,
+        the columns are the contagious rate (one for each value of a 
+        schedule), the recovery rate and the mortality rate (the last two).
+    :cont_rate, reco_rate, mortality, as in sirDerivatives.
+    :N_population (contagious_rate = cont_rate * N_population)
+    :segment (=0) column of the contagious rate in use (for each state).
+    
+    Return:
+    :<array> with the same shape than sensitivity.
+    """
+    state = np.asarray(state, dtype=float)
+    s, i = state[..., 0:1], state[..., 1:2]
+    d_s, d_i = sensitivity[..., 0, :], sensitivity[..., 1, :]
+    in_use = np.arange(sensitivity.shape[-1]) == np.asarray(segment)[..., np.newaxis]
+    # derivatives of each flux (infection, recovery, death) by the rates
+    d_infections = (np.asarray(cont_rate)[..., np.newaxis] * (i * d_s + s * d_i)
+                    + in_use * (s * i / N_population))
+    d_recoveries = reco_rate * d_i
+    d_recoveries[..., -2] += i[..., 0]
+    d_deaths = mortality * d_i
+    d_deaths[..., -1] += i[..., 0]
+    d_fluxes = np.stack((d_infections, d_recoveries, d_deaths), axis=-2)
+    return np.einsum('fj,...fk->...jk', SIR_STOICHIOMETRY, d_fluxes)
+
+def eulerSensitivities(states, sensitivity, h, cont_rate, reco_rate, mortality,
+                       N_population, segment=0):
+    """
+    Sensitivities of the Euler steps of a block (in place), the exact 
+    derivative of the discrete map Z(n+1) = Z(n) + h*dZ/dt(n). Only the rows 
+    of S and I are a recursion (loop over the steps), the ones of R and D 
+    are cumulative sums of the rows of I.
+    Args:
+    :states <array> (n, 4) computed states of the block.
+    :sensitivity <array> (n, 4, n_rates), the first row is the initial one
+        (columns as in sirSensitivityDerivatives).
+    :h, cont_rate, reco_rate, mortality, N_population, as in the model, the 
+        contagious rate could be an array with the one of each step (n - 1, ).
+    :segment (=0) column of the contagious rate of each step, scalar or (n - 1, )
+    """
+    s, i = states[:-1, 0], states[:-1, 1]
+    a, b = (h * cont_rate * i).tolist(), (h * cont_rate * s).tolist()
+    f, g = (h * s * i / N_population).tolist(), (h * i).tolist()
+    c = h * (reco_rate + mortality)
+    segments = np.broadcast_to(segment, s.shape).tolist()
+    
+    z_s, z_i = sensitivity[0, 0].tolist(), sensitivity[0, 1].tolist()
+    rows = []
+    for a_n, b_n, f_n, g_n, k_n in zip(a, b, f, g, segments):
+        infections = [a_n*z_s_k + b_n*z_i_k for z_s_k, z_i_k in zip(z_s, z_i)]
+        infections[k_n] += f_n
+        z_s = [z_s_k - inf_k for z_s_k, inf_k in zip(z_s, infections)]
+        z_i = [z_i_k + inf_k - c*z_i_k for z_i_k, inf_k in zip(z_i, infections)]
+        z_i[-2] -= g_n
+        z_i[-1] -= g_n
+        rows.append(z_s + z_i)
+    if rows:
+        sensitivity[1:, :2] = np.reshape(rows, (len(rows), 2, -1))
+    
+    d_i = h * sensitivity[:-1, 1]
+    sensitivity[1:, 2] = d_i * reco_rate
+    sensitivity[1:, 2, -2] += g
+    sensitivity[1:, 3] = d_i * mortality
+    sensitivity[1:, 3, -1] += g
+    np.cumsum(sensitivity[:, 2:], axis=0, out=sensitivity[:, 2:])
+
+def eulerLoop(states, h_conts, h_reco, h_mort, N_population):
+    """
+    Explicit Euler steps of a block (in place): rows 1: of states from the 
+    first one, each variable kept in [0.01, N_population]. Plain scalar code, 
+    compiled by Numba for the 'numba' backend (eulerLoopCompiled).
+    Args:
+    :states <array> (n, 4) with the initial (S, I, R, D) in the first row.
+    :h_conts <array or list> (n - 1, ) t_step * CONT_RATE of each step.
+    :h_reco, h_mort, t_step * RECO_RATE, t_step * MORTALITY.
+    """
+    N = N_population
+    s, i_, r, d = states[0, 0], states[0, 1], states[0, 2], states[0, 3]
+    for k in range(1, len(states)):
+        infections = h_conts[k - 1]*s*i_
+        recoveries, deaths = h_reco*i_, h_mort*i_
+        s  = max(min(N, s - infections), 0.01)
+        i_ = max(min(N, i_ + infections - recoveries - deaths), 0.01)
+        r  = max(min(N, r + recoveries), 0.01)
+        d  = max(min(N, d + deaths), 0.01)
+        states[k, 0], states[k, 1], states[k, 2], states[k, 3] = s, i_, r, d
+
+# Compiled version of the loop (None if Numba is not installed)
+eulerLoopCompiled = None if numba is None else numba.njit(cache=True)(eulerLoop)
+
+def growRows(array, min_rows):
+    """ Copy of the array with (at least) min_rows rows, at least doubling
+    its size so consecutive extensions are amortized. """
+    new = np.empty((max(min_rows, 2*len(array)),) + array.shape[1:], 
+                   dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+def _trajectoryColumn(j):
+    """ Stored values of the j-th variable (view of the trajectory array). """
+    return property(lambda self: self._trajectory[:self._n, j])
+
+def _incrementsColumn(j):
+    """ Increments of the j-th variable in each step (computed on demand). """
+    return property(lambda self: np.diff(self._trajectory[:self._n, j]))
+
+def sirPeak(N_population, contagious_rate, recovery_rate, mortality_rate=0.0,
+            susceptible_0=None, infected_0=1, day_0=0, n_nodes=32):
+    """
+    Peak of the infected (day, infected) without stepping the ODE system. 
+    From the integral of the first two equations:
+        i(s) = s_0 + i_0 - s + (N/R0) * log(s / s_0)
+    the maximum is at s = N/R0, and the time to get there is the quadrature
+    of dt = -ds / (CONT_RATE * s * i(s)) (Gauss-Legendre, over a variable 
+    that makes the integrand nearly constant along the exponential growth).
+    The rates could be arrays (broadcasted) to get many peaks at once.
+    Args:
+    :N_population, contagious_rate, recovery_rate, mortality_rate as in 
+        DiseaseSimulation.
+    :susceptible_0 (=N_population - infected_0), infected_0, day_0 initial values.
+    :n_nodes number of nodes of the quadrature.
+    
+    Return:
+    :<tuple> (day, infected) of the maximum (the initial ones if the infected
+        only decrease).
+    """
+    if susceptible_0 is None:
+        susceptible_0 = N_population - infected_0
+    beta  = np.asarray(contagious_rate, dtype=float) / N_population
+    gamma = np.asarray(recovery_rate, dtype=float) + mortality_rate
+    s_0, i_0 = float(susceptible_0), float(infected_0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        _C = gamma / beta          # = N / R0, susceptible at the peak
+        growing = s_0 > _C
+        _C = np.where(growing, _C, s_0)
+        i_max = s_0 + i_0 - _C * (1 + np.log(s_0 / _C))
         
+        # x = log(s_0 / s) from 0 to X, i(x) ~ i_0 + (s_0 - C)*x at the start
+        X = np.log(s_0 / _C)
+        c = np.where(growing, (s_0 - _C) * X / i_0, 1.0)
+        nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+        u = 0.5 * (nodes + 1)
+        X, c, _C = X[..., np.newaxis], c[..., np.newaxis], _C[..., np.newaxis]
+        x  = X * ((1 + c)**u - 1) / c
+        dx = X * np.log1p(c) * (1 + c)**u / c
+        infected = i_0 + s_0 * (-np.expm1(-x)) - _C * x
+        t_max = 0.5 * np.sum(weights * dx / infected, axis=-1) / beta
+    
+    t_max = np.where(growing, t_max, 0.0)
+    if t_max.ndim == 0:
+        return day_0 + float(t_max), float(i_max)
+    return day_0 + t_max, i_max
+
+# Results of DiseaseSimulation.runBatch()
+BatchResults = namedtuple('BatchResults',
+                          'time trajectories max_infected convergence_day')
+# Results of DiseaseSimulation.runStochastic()
+StochasticResults = namedtuple('StochasticResults',
+                               'time quantiles bands extinction_probability max_infected')
+
 
 class DiseaseSimulation(object):
     # =========================================================================
@@ -49,6 +359,23 @@ class DiseaseSimulation(object):
     TOP_N = 500000
     PRINT = True
     
+    # Integration engines for __call__
+    BACKEND_PYTHON = 'python'   # reference loop, one variable at a time
+    BACKEND_NUMPY  = 'numpy'    # vectorized state in a preallocated array
+    BACKEND_NUMBA  = 'numba'    # as 'numpy', with the step loop compiled by 
+                                # Numba (the 'numpy' loop if it is not installed)
+    BACKENDS = (BACKEND_PYTHON, BACKEND_NUMPY, BACKEND_NUMBA)
+    # Integration methods
+    METHOD_EULER = 'euler'      # fixed step t_step
+    METHOD_RK45  = 'rk45'       # adaptive Dormand-Prince 5(4), see atol/rtol
+    METHODS = (METHOD_EULER, METHOD_RK45)
+    # Events located inside the steps (for the 'numpy' backend and 'rk45')
+    EVENT_PEAK = 'peak'                   # dI/dt = 0, the maximum of infected
+    EVENT_HERD_IMMUNITY = 'herd_immunity' # S = N / R0
+    EVENT_EXTINCTION = 'extinction'       # I = 1 person (after the peak)
+    RK45_BLOCK = 64      # accepted steps between events searches
+    EULER_BLOCK = 20000  # steps in memory for the 'numpy' backend
+    
     # Initial Values.
     DAY_0 = 0
     INITIALIZERS = {'infected_0'  : 1,
@@ -62,47 +389,278 @@ class DiseaseSimulation(object):
                  N_population    = 200000, # persons
                  contagious_rate = 0.0,    # persons/day
                  recovery_rate   = 0.0,    # person/day (= time to recovery**-1)
-                 mortality_rate  = 0.0     # average mortality for the infected
+                 mortality_rate  = 0.0,    # average mortality for the infected
+                 backend = BACKEND_PYTHON,
+                 method  = METHOD_EULER,
+                 atol    = 1e-3,  # persons
+                 rtol    = 1e-6,
+                 output_every = None, # days
+                 record_at    = None, # days
+                 sensitivities = False,
+                 day_0        = None,
+                 initializers = None,
+                 stop_when_max_infected = None,
+                 print_logs   = None
                  ):
         """ 
         Args:
         :contagious_rate = contacts/(day * person) *
             * transmission probability by contact
+            It could change with the time (f.e. with interventions), given 
+            as a schedule (days, values), values[j] from days[j] on, or an 
+            array with a value for each day from day_0.
         :recovery_rate = 1 / days to recovery (period of infection)
+        :backend (='python') default integration engine, see BACKENDS.
+        :method (='euler') integration method, with 'rk45' the step is adapted
+            to keep the local error under atol + rtol*|y| (t_step is only
+            the first step to try).
+        :output_every (optional) keep only the states every output_every days
+            (interpolated inside the steps), f.e, 1 for daily values.
+        :record_at (optional) keep only the states at these days (the run
+            ends at the last one). Both options require the 'numpy' backend or the 'rk45' method.
+        :sensitivities (=False) integrate also the derivatives of the states 
+            by the three rates (see the sensitivities property), with the
+            'numpy' backend or the 'rk45' method.
+        :day_0, initializers <dict> (infected_0, dead_0, recovered_0),
+            stop_when_max_infected, print_logs (optional) configuration of
+            this object only, by default the one of the class (setInitializers,
+            stopWhenMaxInfectedReached, setLogsPrint) when it is created, so 
+            the objects do not depend on later changes of the class.
         """
+        assert backend in self.BACKENDS, \
+            "backend must be one of {}, got '{}'".format(self.BACKENDS, backend)
+        assert method in self.METHODS, \
+            "method must be one of {}, got '{}'".format(self.METHODS, method)
+        self.backend = backend
+        self.method  = method
+        self.atol, self.rtol = atol, rtol
+        assert (output_every is None) or (record_at is None), \
+            "give output_every or record_at, not both"
+        self.output_every = output_every
+        self.record_at = None if record_at is None else np.sort(record_at)
+        self.with_sensitivities = sensitivities
+        self.__setConfiguration(day_0, initializers, stop_when_max_infected, 
+                                print_logs)
         
         self.t_step  = t_step #min(t_step, days * contagious_rate * recovery_rate / 1e5)
         self.days    = days
         self.N_steps = int(days / t_step)
         self.N_population = N_population
         
-        self.time = None
-        self.susceptible = [N_population - sum(self.INITIALIZERS.values())]
-        self.infected    = [self.INITIALIZERS['infected_0']]
-        self.recovered   = [self.INITIALIZERS['recovered_0']]
-        self.dead        = [self.INITIALIZERS['dead_0']]
+        self.initial_state = (N_population - sum(self.INITIALIZERS.values()),
+                              self.INITIALIZERS['infected_0'],
+                              self.INITIALIZERS['recovered_0'],
+                              self.INITIALIZERS['dead_0'])
         self._setCalculationVars()
+        self._trajectory[0] = self.initial_state
         
-        self.CONT_FACTOR = contagious_rate  # Dimensionless Transmissibility
+        self.contagious_schedule = self.parseContagiousRate(contagious_rate, self.DAY_0)
+        if self.contagious_schedule is not None:
+            contagious_rate = float(self.contagiousRate(self.DAY_0))
+        self.N_RATES = 2 + (1 if self.contagious_schedule is None 
+                            else len(self.contagious_schedule[1]))
+        self.CONT_FACTOR = contagious_rate  # Dimensionless Transmissibility (initial)
         self.CONT_RATE = contagious_rate/N_population # Rate for the calculations
         self.RECO_RATE = recovery_rate
         self.MORTALITY = mortality_rate
         self.INFECTEDS_COULD_DIE = mortality_rate > 0.0 
         
         self.R_0 = self.CONT_FACTOR / (self.RECO_RATE + self.MORTALITY)
-        self.R_effective = self.R_0 * self.susceptible[0] / self.N_population
+        self.R_effective = self.R_0 * self.initial_state[0] / self.N_population
         
         self.max_infected = None
+        self.events = {}
         self.__defineDerivates()
         
+    def __setConfiguration(self, day_0, initializers, stop_when_max_infected, 
+                           print_logs):
+        """ Instance attributes that shadow the class configuration. """
+        self.DAY_0 = self.DAY_0 if day_0 is None else day_0
+        self.INITIALIZERS = dict(self.INITIALIZERS)
+        if initializers is not None:
+            assert set(initializers) <= set(self.INITIALIZERS), \
+                "initializers must be in {}, got {}".format(tuple(self.INITIALIZERS), 
+                                                            tuple(initializers))
+            self.INITIALIZERS.update(initializers)
+        if stop_when_max_infected is None:
+            stop_when_max_infected = self.STOP_WHEN_MAX_INFECTED_ACHIEVED
+        self.STOP_WHEN_MAX_INFECTED_ACHIEVED = stop_when_max_infected
+        self.PRINT = self.PRINT if print_logs is None else print_logs
+    
+    @staticmethod
+    def parseContagiousRate(contagious_rate, day_0=0):
+        """ Schedule of a time dependent contagious rate.
+        Args:
+        :contagious_rate, a number (constant), a tuple (days, values) or an 
+            array with a value for each day from day_0.
+        Return:
+        :None for a constant rate, or <tuple> (days, values) <arrays>
+        """
+        if np.ndim(contagious_rate) == 0:
+            return None
+        if isinstance(contagious_rate, tuple) and len(contagious_rate) == 2 \
+                and np.ndim(contagious_rate[0]) == 1:
+            days, values = contagious_rate
+        else:
+            values = contagious_rate
+            days = day_0 + np.arange(len(values))
+        days, values = np.asarray(days, dtype=float), np.asarray(values, dtype=float)
+        assert days.shape == values.shape and len(days) > 0, \
+            "the schedule needs a value for each day, got {} and {}".format(days.shape, 
+                                                                           values.shape)
+        assert np.all(np.diff(days) > 0), "the days of the schedule must increase"
+        return days, values
+    
+    def scheduleSegment(self, t):
+        """ Index of the value of the contagious rate schedule at the days t 
+        (0 for a constant rate). """
+        if self.contagious_schedule is None:
+            return np.zeros(np.shape(t), dtype=int)
+        days = self.contagious_schedule[0]
+        return np.maximum(np.searchsorted(days, t, side='right') - 1, 0)
+    
+    def contagiousRate(self, t):
+        """ Contagious rate at the days t (scalar or array). """
+        if self.contagious_schedule is None:
+            return np.full(np.shape(t), float(self.CONT_FACTOR))
+        return self.contagious_schedule[1][self.scheduleSegment(t)]
+    
+    def cacheKey(self):
+        """ Hashable key with every input that changes the results of a run 
+        (not the logs), see simulationCache.SimulationCache. """
+        record_at = None if self.record_at is None else tuple(self.record_at.tolist())
+        contagious = self.CONT_FACTOR
+        if self.contagious_schedule is not None:
+            contagious = tuple(tuple(array.tolist()) for array in self.contagious_schedule)
+        return (self.t_step, self.days, self.N_population, 
+                contagious, self.RECO_RATE, self.MORTALITY,
+                self.backend, self.method, self.atol, self.rtol,
+                self.output_every, record_at, self.with_sensitivities,
+                self.DAY_0, tuple(sorted(self.INITIALIZERS.items())),
+                self.STOP_WHEN_MAX_INFECTED_ACHIEVED, self.TOP_N)
+    
+    def runState(self):
+        """ Copy of the results of the last run <dict> (to restore them in an
+        object with the same cacheKey, see restoreRunState). """
+        state = {'trajectory': self._trajectory[:self._n].copy(),
+                 'time': None if self._time is None else self._time[:self._n].copy(),
+                 'sensitivities': None if self._sensitivities is None 
+                                  else self._sensitivities[:self._n].copy(),
+                 'uniform_time': self._uniform_time,
+                 'converged': getattr(self, '_converged', False),
+                 'max_infected': self.max_infected,
+                 'events': dict(self.events)}
+        state['nbytes'] = sum(state[name].nbytes for name in 
+                              ('trajectory', 'time', 'sensitivities') 
+                              if state[name] is not None)
+        return state
+    
+    def restoreRunState(self, state, copy=True):
+        """ Set the results of a run given by runState (the arrays are copied,
+        the state could be restored again). Without copy the arrays are used 
+        as they are (f.e. read only memory maps, see resultStore). """
+        if copy:
+            _copy = lambda array: None if array is None else array.copy()
+        else:
+            _copy = lambda array: array
+        self._trajectory = _copy(state['trajectory'])
+        self._n = len(self._trajectory)
+        self._time = _copy(state['time'])
+        self._sensitivities = _copy(state['sensitivities'])
+        self._uniform_time = state['uniform_time']
+        self._converged = state['converged']
+        self.max_infected = state['max_infected']
+        self.events = dict(state['events'])
+    
     def _setCalculationVars(self):
-        """ Setting attributes as lists"""
-        for _, deriv in self.DERIVATES_1st.items():
-            setattr(self, deriv, [])
+        """ Setting the storage of the results: an array with a row (S, I, R, D)
+        for each step, sized for N_steps when running (see _expectedRows) and 
+        extended if the run continues after days. The time is computed from 
+        the row index (fixed step) or stored (adaptive step or sampled output).
+        """
+        self._trajectory = np.empty((1, 4))
+        self._n = 1
+        self._time = None
+        self._uniform_time = False
+        self._sensitivities = None
+    
+    def _expectedRows(self):
+        """ Rows to store for a run that ends at days. """
+        if self.record_at is not None:
+            return len(self.record_at)
+        elif self.output_every:
+            return int(self.days / self.output_every) + 1
+        return self.N_steps + 1
+    
+    def _growStorage(self, min_rows):
+        """ Extend the storage to min_rows (at least doubling it). """
+        if min_rows > len(self._trajectory):
+            self._trajectory = growRows(self._trajectory, min_rows)
+            if self._time is not None:
+                self._time = growRows(self._time, len(self._trajectory))
+            if self._sensitivities is not None:
+                self._sensitivities = growRows(self._sensitivities, 
+                                               len(self._trajectory))
+    
+    @property
+    def time(self):
+        """ Times of the stored states (None if the model has not been run) """
+        if self._uniform_time:
+            return self.DAY_0 + self.t_step * np.arange(self._n)
+        if self._time is not None:
+            return self._time[:self._n]
+        return None
+    
+    def at(self, days):
+        """ States (S, I, R, D) at the days, interpolated between the stored 
+        ones. For the fixed step of the euler method (all the steps stored) 
+        the index of the rows is computed from the day and the interpolation
+        is linear, as the Euler steps. Otherwise (rk45, output_every or 
+        record_at) the rows are searched in the stored times and the 
+        interpolation is the cubic Hermite one, with the derivatives of the 
+        model at the stored states. The days out of the run get the first or
+        last state.
+        Args:
+        :days, scalar or <array>
+        Return:
+        :<array> with shape (..., 4)
+        """
+        days = np.asarray(days, dtype=float)
+        if self._n == 1:
+            return np.broadcast_to(self._trajectory[0], days.shape + (4, )).copy()
+        if self._uniform_time:
+            x = np.clip((days - self.DAY_0) / self.t_step, 0, self._n - 1)
+            k = np.minimum(x.astype(int), self._n - 2)
+            frac = (x - k)[..., np.newaxis]
+            return (1 - frac) * self._trajectory[k] + frac * self._trajectory[k + 1]
+        time = self.time
+        days = np.clip(days, time[0], time[-1])
+        k = np.clip(np.searchsorted(time, days, side='right') - 1, 0, self._n - 2)
+        states = self._trajectory[:self._n]
+        rates = (self.contagiousRate(time[k]) / self.N_population, self.RECO_RATE, 
+                 self.MORTALITY)
+        dy_0 = sirDerivatives(states[k], *rates)
+        rates = (self.contagiousRate(time[k + 1]) / self.N_population, ) + rates[1:]
+        dy_1 = sirDerivatives(states[k + 1], *rates)
+        return hermiteInterpolation(days[..., np.newaxis], time[k][..., np.newaxis], 
+                                    time[k + 1][..., np.newaxis], states[k], 
+                                    states[k + 1], dy_0, dy_1)
+    
+    @property
+    def sensitivities(self):
+        """ Jacobian of the stored states by the rates, <array> (n, 4, N_RATES): 
+        d (S, I, R, D) / d (contagious_rate, recovery_rate, mortality_rate)
+        (a column for each value of a contagious rate schedule)
+        (None if the model has not been run with sensitivities=True). """
+        if self._sensitivities is not None:
+            return self._sensitivities[:self._n]
+        return None
     
     @classmethod
     def setInitializers(cls, day_0=0, infected_0=1, dead_0=0, recovered_0=0):
-        """ modify any of the initial values of the model, also the starting day"""
+        """ modify any of the initial values of the model, also the starting day
+        (default for the new objects, see the constructor to set them only 
+        for an object) """
         cls.DAY_0 = day_0
         cls.INITIALIZERS = {'infected_0'  : infected_0,
                             'dead_0'      : dead_0,
@@ -150,6 +708,16 @@ class DiseaseSimulation(object):
                      RECOVERED   : 'd_recovered',
                      DEAD        : 'd_dead'}
     
+    susceptible = _trajectoryColumn(0)
+    infected    = _trajectoryColumn(1)
+    recovered   = _trajectoryColumn(2)
+    dead        = _trajectoryColumn(3)
+    
+    d_susceptible = _incrementsColumn(0)
+    d_infected    = _incrementsColumn(1)
+    d_recovered   = _incrementsColumn(2)
+    d_dead        = _incrementsColumn(3)
+    
     @classmethod
     def setLogsPrint(cls, bool_value):
         assert bool_value in (True, False), "PRINT is boolean, got '{}'".format(bool_value)
@@ -173,33 +741,35 @@ class DiseaseSimulation(object):
         
         self._derivates = {}
         
-        self._derivates[self.SUSCEPTIBLE]= lambda s,i,r,d: -self.CONT_RATE*s*i
-        self._derivates[self.INFECTED]   = lambda s,i,r,d: (self.CONT_RATE*s*i)\
+        # contagious rate of the step (changes with a schedule)
+        self._step_cont_rate = self.CONT_RATE
+        self._derivates[self.SUSCEPTIBLE]= lambda s,i,r,d: -self._step_cont_rate*s*i
+        self._derivates[self.INFECTED]   = lambda s,i,r,d: (self._step_cont_rate*s*i)\
              - ((self.RECO_RATE + self.MORTALITY)*i)
             
         self._derivates[self.RECOVERED]  = lambda s,i,r,d: self.RECO_RATE*i
         self._derivates[self.DEAD]       = lambda s,i,r,d: self.MORTALITY*i
         
     def __euler(self, i):
-        new = {}
-        for var_name, eq in self._derivates.items():
-            
-            new[var_name] = getattr(self, var_name)[-1]
-            step = (self.t_step) * eq(*self.getVariableTuple())
+        if self._n == len(self._trajectory):
+            self._growStorage(self._n + 1)
+        if self.contagious_schedule is not None:
+            self._step_cont_rate = (self.contagiousRate(self.DAY_0 + self.t_step*i)
+                                    / self.N_population)
+        new = self._trajectory[self._n - 1].tolist()
+        for j, (var_name, eq) in enumerate(self._derivates.items()):
+            # the variables already updated in the step are used for the next
+            step = (self.t_step) * eq(*new)
             
-            # Record the the difference
-            getattr(self, self.DERIVATES_1st[var_name]).append(step)
+            new[j] += step
+            new[j] = max(min(self.N_population, new[j]), 0.01)
             
-            new[var_name] += step
-            new[var_name] = max(min(self.N_population, new[var_name]), 0.01)
-            
-            getattr(self, var_name).append(new[var_name])
             # Define the maximum
             if (var_name == self.INFECTED):
                 if (not self.max_infected):
-                    if (step < 0) and (self.infected[-1] > self.INITIALIZERS['infected_0']):
+                    if (step < 0) and (new[j] > self.INITIALIZERS['infected_0']):
                         self.max_infected = (round(self.DAY_0+self.t_step*i, 2),
-                                             round(new[var_name]))
+                                             round(new[j]))
                         if self.STOP_WHEN_MAX_INFECTED_ACHIEVED:
                             self._logPrint("STOPPED IN MAX_INFECTED")
                             self._converged = True
@@ -207,51 +777,517 @@ class DiseaseSimulation(object):
                 else:
                     # If there is less than a person (after reaching the maximum
                     # of infections), the disease has been eradicated.
-                    if (step < 0) and (getattr(self, self.INFECTED)[-1] < 1):
+                    if (step < 0) and (new[j] < 1):
                         self._logPrint("CONVERGENCE ACHIEVED [step {}]".format(i))
                         self._converged = True
-                        
+        
+        self._trajectory[self._n] = new
+        self._n += 1
+    
+    def __eulerBlocks(self, backend=None):
+        """ Euler integration with the S/I/R/D state stored in a preallocated
+        array of EULER_BLOCK rows. The step only writes the new row of the 
+        array, the events and the derivatives are evaluated with array 
+        operations over every block once it is computed (instead of on every
+        step).
+        Yield:
+        :(times, states, derivatives) of each block, the first row is the 
+            last one of the previous block. The arrays are reused for the next
+            block, copy them to keep them. With sensitivities, the 4*N_RATES 
+            values of the sensitivity matrix follow the 4 variables in each row.
+        The contagious rate of each step is looked up (schedule) for the whole
+        block before the loop (eulerLoop, compiled for the 'numba' backend).
+        """
+        compiled = (backend == self.BACKEND_NUMBA) and (eulerLoopCompiled is not None)
+        loop = eulerLoopCompiled if compiled else eulerLoop
+        states = np.empty((max(2, min(self.N_steps, self.EULER_BLOCK)), 4))
+        states[0] = self.initial_state
+        sens = None
+        if self.with_sensitivities:
+            sens = np.zeros((len(states), 4, self.N_RATES))
+        
+        h, N = self.t_step, self.N_population
+        h_reco, h_mort = h*self.RECO_RATE, h*self.MORTALITY
+        i_ini = 0
+        while True:
+            times = self.DAY_0 + h * np.arange(i_ini, i_ini + len(states))
+            cont_rates = self.contagiousRate(times) / N
+            rates = (cont_rates, self.RECO_RATE, self.MORTALITY)
+            h_conts = h * cont_rates[:-1]
+            loop(states, h_conts if compiled else h_conts.tolist(), h_reco, h_mort, N)
+            
+            derivatives = sirDerivatives(states, *rates)
+            i_last = self.__detectEvents(times, states, derivatives, i_ini)
+            block = (times, states, derivatives)
+            if sens is not None:
+                segments = self.scheduleSegment(times)
+                eulerSensitivities(states, sens, h, cont_rates[:-1], *rates[1:], N, 
+                                   segment=segments[:-1])
+                d_sens = sirSensitivityDerivatives(states, sens, *rates, N, 
+                                                   segment=segments)
+                block = (times, 
+                         np.hstack((states, sens.reshape(len(states), -1))),
+                         np.hstack((derivatives, d_sens.reshape(len(states), -1))))
+            if self._converged:
+                yield tuple(array[:i_last + 1] for array in block)
+                return
+            yield block
+            
+            i_ini += len(states) - 1
+            if i_ini + 1 >= self.TOP_N:
+                self._logPrint("WARNING: MAX ITERATIONS reached, Convergence NOT ACHIEVED")
+                return
+            states[0] = states[-1]
+            if sens is not None:
+                sens[0] = sens[-1]
+    
+    def eventFunctions(self):
+        """ Functions g(t, state) of the events, which cross zero decreasing
+        when the event happens (state with shape (..., 4)). """
+        N, gamma = self.N_population, self.RECO_RATE + self.MORTALITY
+        rates = (self.RECO_RATE, self.MORTALITY)
+        def herdImmunity(t, y):
+            # S = N / R0(t)
+            with np.errstate(divide='ignore'):
+                return y[..., 0] - N * gamma / self.contagiousRate(t)
+        return {
+            self.EVENT_PEAK: 
+                lambda t, y: sirDerivatives(y, self.contagiousRate(t) / N, *rates)[..., 1],
+            self.EVENT_HERD_IMMUNITY: herdImmunity,
+            self.EVENT_EXTINCTION: lambda t, y: y[..., 1] - 1
+            }
+    
+    def __detectEvents(self, times, states, derivatives, i_ini):
+        """ 
+        Search the events in a block of steps (with array operations) and 
+        locate them inside their step by root finding over the interpolation
+        of the step. The maximum of infected is the peak event.
+        Args:
+        :times, states, derivatives of the block (first row overlaps with the
+            last one of the previous block), i_ini is the step of the first row.
+        Return:
+        :<int> row (of the block) where the run stops, None if it goes on.
+        """
+        g_funcs = self.eventFunctions()
+        if (i_ini == 0) and (derivatives[0, 1] <= 0):
+            # The infected decrease from the beginning, no peak.
+            self.events[self.EVENT_PEAK] = (times[0], states[0])
+        
+        rows = {}
+        for name in (self.EVENT_PEAK, self.EVENT_HERD_IMMUNITY, 
+                     self.EVENT_EXTINCTION):
+            if name in self.events:
+                continue
+            g = g_funcs[name](times, states)
+            crossing = (g[:-1] > 0) & (g[1:] <= 0)
+            if name == self.EVENT_EXTINCTION:
+                if self.EVENT_PEAK not in self.events:
+                    continue
+                t_peak = self.events[self.EVENT_PEAK][0]
+                if t_peak == self.DAY_0:
+                    # maximum at the start, with a single infected g starts at 0
+                    crossing |= (g[:-1] >= 0) & (g[1:] < 0)
+                crossing &= times[1:] > t_peak
+            crossing = np.flatnonzero(crossing)
+            if crossing.size == 0:
+                continue
+            k = crossing[0]
+            rows[name] = k + 1
+            self.events[name] = locateEvent(g_funcs[name], 
+                                            times[k], times[k + 1],
+                                            states[k], states[k + 1],
+                                            derivatives[k], derivatives[k + 1])
+        
+        if (self.EVENT_PEAK in rows) or (i_ini == 0 and self.EVENT_PEAK in self.events):
+            t_max, state_max = self.events[self.EVENT_PEAK]
+            self.max_infected = (round(float(t_max), 2), round(state_max[1]))
+            if self.STOP_WHEN_MAX_INFECTED_ACHIEVED:
+                self._logPrint("STOPPED IN MAX_INFECTED")
+                self._converged = True
+                i_last = rows.get(self.EVENT_PEAK, 0)
+                self.events = dict((name, event) for name, event in self.events.items()
+                                   if event[0] <= times[i_last])
+                return i_last
+        if self.EVENT_EXTINCTION in rows:
+            # If there is less than a person (after reaching the maximum
+            # of infections), the disease has been eradicated.
+            self._logPrint("CONVERGENCE ACHIEVED [step {}]"
+                           .format(i_ini + rows[self.EVENT_EXTINCTION]))
+            self._converged = True
+            return rows[self.EVENT_EXTINCTION]
+        return None
+    
+    def __adaptiveBlocks(self):
+        """ Dormand-Prince 5(4) integration with error control (atol, rtol), 
+        the time grid is given by the accepted steps. The events are searched
+        every RK45_BLOCK steps.
+        Yield:
+        :(times, states, derivatives) of each block, the first row is the 
+            last one of the previous block (with the 4*N_RATES values of the 
+            sensitivity matrix after the variables if they are integrated).
+        """
+        N = self.N_population
+        rates = (self.RECO_RATE, self.MORTALITY)
+        y_0 = np.array(self.initial_state, dtype=float)
+        if self.with_sensitivities:
+            def derivatives(t, y):
+                cont_rate = self.contagiousRate(t) / N
+                d_sens = sirSensitivityDerivatives(y[:4], y[4:].reshape(4, -1), 
+                                                   cont_rate, *rates, N,
+                                                   segment=self.scheduleSegment(t))
+                return np.concatenate((sirDerivatives(y[:4], cont_rate, *rates), 
+                                       d_sens.ravel()))
+            y_0 = np.concatenate((y_0, np.zeros(4 * self.N_RATES)))
+        else:
+            derivatives = lambda t, y: sirDerivatives(y, self.contagiousRate(t) / N, *rates)
+        
+        block = [(self.DAY_0, y_0, derivatives(self.DAY_0, y_0))]
+        steps = dormandPrince(derivatives, self.DAY_0, y_0, 
+                              self.atol, self.rtol, h=self.t_step)
+        i_ini = 0
+        while True:
+            block.extend(islice(steps, self.RK45_BLOCK))
+            times, states, d_states = map(np.array, zip(*block))
+            i_last = self.__detectEvents(times, states[:, :4], d_states[:, :4], i_ini)
+            if self._converged:
+                yield times[:i_last + 1], states[:i_last + 1], d_states[:i_last + 1]
+                return
+            yield times, states, d_states
+            
+            i_ini += len(times) - 1
+            if i_ini + 1 >= self.TOP_N:
+                self._logPrint("WARNING: MAX ITERATIONS reached, Convergence NOT ACHIEVED")
+                return
+            block = block[-1:]
+    
+    def __blocks(self, backend=None):
+        """ Blocks of the integration for the method ('numpy' or 'numba' 
+        backend for euler) """
+        self._converged = False
+        self.max_infected = None
+        self.events = {}
+        if self.method == self.METHOD_RK45:
+            return self.__adaptiveBlocks()
+        return self.__eulerBlocks(backend)
+    
+    def __outputTimes(self, t_a, t_b, first):
+        """ Times to record in (t_a, t_b] (also t_a if it is the first block), 
+        None when every state is recorded. """
+        if self.record_at is not None:
+            times = self.record_at
+        elif self.output_every:
+            eps = 1e-9 * self.output_every
+            j_a = np.ceil((t_a - self.DAY_0 - eps) / self.output_every)
+            j_b = np.floor((t_b - self.DAY_0 + eps) / self.output_every)
+            times = self.DAY_0 + self.output_every * np.arange(j_a, j_b + 1)
+        else:
+            return None
+        eps = 1e-9 * (t_b - t_a)
+        return times[((times > t_a + eps) | first & (times >= t_a - eps)) 
+                     & (times <= t_b + eps)]
+    
+    def __outputRows(self, backend=None):
+        """ Run the blocks of the integration and give the (times, states) to
+        keep of each one (the ones at the output times if they are set). """
+        first = True
+        for times, states, derivatives in self.__blocks(backend):
+            t_out = self.__outputTimes(times[0], times[-1], first)
+            if t_out is None:
+                yield (times, states) if first else (times[1:], states[1:])
+            elif len(t_out) > 0:
+                k = np.clip(np.searchsorted(times, t_out) - 1, 0, len(times) - 2)
+                y_out = hermiteInterpolation(t_out[:, np.newaxis], 
+                                             times[k, np.newaxis], 
+                                             times[k + 1, np.newaxis],
+                                             states[k], states[k + 1],
+                                             derivatives[k], derivatives[k + 1])
+                yield t_out, y_out
+            if (self.record_at is not None) and (times[-1] >= self.record_at[-1]):
+                return
+            first = False
+    
+    def iterate(self):
+        """ 
+        Run the model yielding the rows (t, S, I, R, D) as they are computed,
+        or only the ones at output_every/record_at if they are set. The rows 
+        are not stored, so the memory used does not depend on the duration.
+        ('numpy' engine for the euler method, 'numba' if it is the backend)
+        """
+        for times, states in self.__outputRows(self.backend):
+            for t, state in zip(times, states):
+                yield (t, ) + tuple(state[:4])
     
-    def __call__(self):
-        """ run the execution for the object inputs """
+    def __runBlocks(self, backend=None):
+        """ Store the rows to keep of all the blocks. """
+        sampled = (self.output_every is not None) or (self.record_at is not None)
+        self._uniform_time = (self.method == self.METHOD_EULER) and not sampled
+        self._growStorage(self._expectedRows())
+        if not self._uniform_time:
+            self._time = np.empty(len(self._trajectory))
+        if self.with_sensitivities:
+            self._sensitivities = np.empty((len(self._trajectory), 4, self.N_RATES))
+        self._n = 0
+        for times, states in self.__outputRows(backend):
+            n_new = self._n + len(times)
+            self._growStorage(n_new)
+            self._trajectory[self._n : n_new] = states[:, :4]
+            if self.with_sensitivities:
+                self._sensitivities[self._n : n_new] = states[:, 4:].reshape(
+                    len(states), 4, self.N_RATES)
+            if not self._uniform_time:
+                self._time[self._n : n_new] = times
+            self._n = n_new
+    
+    def __call__(self, backend=None):
+        """ run the execution for the object inputs 
+        Args:
+        :backend (optional) integration engine ('python', 'numpy' or 'numba'), 
+            by default the one given in the constructor (only for 'euler' 
+            method).
+        """
+        backend = backend or self.backend
+        assert backend in self.BACKENDS, \
+            "backend must be one of {}, got '{}'".format(self.BACKENDS, backend)
+        if not self._trajectory.flags.writeable:
+            # results restored from read only arrays
+            self._setCalculationVars()
+            self._trajectory[0] = self.initial_state
+        if (self.method == self.METHOD_RK45) or (backend != self.BACKEND_PYTHON):
+            return self.__runBlocks(backend)
+        assert (self.output_every is None) and (self.record_at is None), \
+            "output_every/record_at require the 'numpy' backend or 'rk45' method"
+        assert not self.with_sensitivities, \
+            "sensitivities require the 'numpy' backend or 'rk45' method"
+        
+        # results of a previous run (or restored) are discarded
         self._converged = False
+        self.max_infected = None
+        self.events = {}
+        self._n = 1
+        self._trajectory[0] = self.initial_state
+        self._uniform_time = True
+        self._growStorage(self._expectedRows())
         iterations, ini_step = 1, 0
         while not self._converged:
             self._logPrint(f"Iter {iterations}")
             for i in range(ini_step, (iterations * self.N_steps)-1):
                 if self._converged:
-                    len_ = len(self.infected)
-                    self.time = [self.DAY_0+ j*self.t_step for j in range(len_)]
                     break
                 self.__euler(i)
             if i >= self.TOP_N:
                 self._logPrint("WARNING: MAX ITERATIONS reached, Convergence NOT ACHIEVED")
-                self.time = [self.DAY_0+ j*self.t_step 
-                             for j in range(len(self.infected))]
                 break
             # Loop again if the process has not reached convergence
             ini_step = self.N_steps * iterations
             iterations += 1
+
+    @classmethod
+    def runBatch(cls, param_grid, t_step=0.01, days=200, N_population=200000,
+                 mortality_rate=0.0, day_0=None, initializers=None, 
+                 stop_when_max_infected=None, print_logs=None):
+        """
+        Integrate many parameter sets in a single loop, the states of all the
+        runs are a (n_params, 4) matrix advanced with one array operation per
+        step (explicit Euler, as the 'numpy' backend). Initial values and the
+        stop criteria are the ones of the class, unless they are given. As in
+        the 'numpy' backend, the maximum of the runs whose infected decrease
+        from the beginning (R0 < 1) is the initial state, and they converge
+        when the infected drop below a person. The maximum and convergence 
+        are the steps where the infected decrease (not located inside them).
+        Args:
+        :param_grid <list of tuples> (contagious_rate, recovery_rate) or
+            (contagious_rate, recovery_rate, mortality_rate), also an array
+            with shape (n_params, 2 or 3).
+        :t_step, days, N_population, same as for the constructor (common to
+            all the runs).
+        :mortality_rate (=0.0) for the parameter sets without it.
+        :day_0, initializers, stop_when_max_infected, print_logs (optional)
+            as for the constructor.
+
+        Return:
+        :BatchResults <namedtuple>
+            time <array> (n_steps, )
+            trajectories <array> (n_steps, n_params, 4) with (S, I, R, D)
+            max_infected <array> (n_params, 2) with (day, infected), nan if
+                the maximum has not been reached.
+            convergence_day <array> (n_params, ), nan if not converged.
+        """
+        params = np.array(param_grid, dtype=float, ndmin=2)
+        assert params.shape[1] in (2, 3), \
+            "param_grid needs 2 or 3 columns, got {}".format(params.shape[1])
+        if params.shape[1] == 2:
+            params = np.column_stack((params, np.full(len(params), mortality_rate)))
+        cont, reco, mort = params[:, 0] / N_population, params[:, 1], params[:, 2]
+        n_params = len(params)
+        N_steps  = int(days / t_step)
+        day_0 = cls.DAY_0 if day_0 is None else day_0
+        initializers = {**cls.INITIALIZERS, **(initializers or {})}
+        if stop_when_max_infected is None:
+            stop_when_max_infected = cls.STOP_WHEN_MAX_INFECTED_ACHIEVED
+        print_logs = cls.PRINT if print_logs is None else print_logs
+
+        states = np.empty((N_steps, n_params, 4))
+        states[0] = (N_population - sum(initializers.values()), initializers['infected_0'],
+                     initializers['recovered_0'], initializers['dead_0'])
+        # The infected decrease from the beginning, the maximum is the first row.
+        peak_at_start = sirDerivatives(states[0], cont, reco, mort)[:, 1] <= 0
+        i_max  = np.where(peak_at_start, 0, -1)
+        i_conv = np.full(n_params, -1)
+
+        i_ini, i_end = 0, N_steps
+        while True:
+            for i in range(i_ini, i_end - 1):
+                np.clip(states[i] + t_step*sirDerivatives(states[i], cont, reco, mort),
+                        0.01, N_population, out=states[i + 1])
+
+            # first step (of the block) decreasing the infected after the
+            # maximum and after dropping below a person, for every run.
+            infected = states[i_ini:i_end, :, 1]
+            steps = np.arange(i_ini, i_end - 1)[:, np.newaxis]
+            decreasing = infected[1:] < infected[:-1]
+
+            found = (i_max < 0) & decreasing.any(axis=0)
+            i_max[found] = i_ini + decreasing.argmax(axis=0)[found]
+
+            extinct = decreasing & (infected[1:] < 1) \
+                      & (i_max >= 0) & (steps > i_max)
+            found = (i_conv < 0) & extinct.any(axis=0)
+            i_conv[found] = i_ini + extinct.argmax(axis=0)[found]
+            if stop_when_max_infected:
+                i_conv = np.where(i_conv < 0, i_max, i_conv)
+
+            if (i_conv >= 0).all():
+                break
+            if i_end >= cls.TOP_N:
+                if print_logs:
+                    print("WARNING: MAX ITERATIONS reached, Convergence NOT ACHIEVED "
+                          "for {} parameter sets".format((i_conv < 0).sum()))
+                break
+            # Extend the integration for another block of N_steps
+            i_ini, i_end = i_end - 1, i_end + N_steps
+            if i_end > len(states):
+                states = growRows(states, i_end)
+
+        states = states[:i_conv.max() + 2] if (i_conv >= 0).all() else states[:i_end]
+        time = day_0 + t_step * np.arange(len(states))
+
+        runs = np.arange(n_params)
+        max_infected = np.full((n_params, 2), np.nan)
+        reached = i_max >= 0
+        peak_row = np.where(peak_at_start, 0, i_max + 1)
+        max_infected[reached, 0] = time[i_max[reached]]
+        max_infected[reached, 1] = states[peak_row[reached], runs[reached], 1]
+        convergence_day = np.where(i_conv >= 0, time[i_conv], np.nan)
+
+        return BatchResults(time, states, max_infected, convergence_day)
+
+    def runStochastic(self, replicates=1000, seed=None, tau=0.1, output_every=1.0,
+                      quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """
+        Stochastic version of the model (tau-leaping), for the small numbers 
+        of infected where the disease could die out. The persons are integers
+        and in each leap of tau days, for all the replicates at once:
+            infections ~ Binomial(S, 1 - exp(-CONT_RATE * I * tau))
+            removed    ~ Binomial(I, 1 - exp(-(RECO_RATE + MORTALITY) * tau))
+            deaths     ~ Binomial(removed, MORTALITY / (RECO_RATE + MORTALITY))
+        The replicates without infected are not drawn any more. Only the 
+        quantiles of the states every output_every days are kept (not the 
+        trajectory of each replicate). It runs from day_0 to day_0 + days 
+        with the initial values and the contagious rate (or schedule) of the 
+        object, its trajectory is not changed.
+        Args:
+        :replicates (=1000) number of runs.
+        :seed (optional) for the numpy.random.Generator, the same seed gives
+            the same results.
+        :tau (=0.1) days of each leap.
+        :output_every (=1.0) days between the stored quantiles (rounded to a 
+            multiple of tau).
+        :quantiles (=(0.05, 0.25, 0.5, 0.75, 0.95)) of the replicates.
         
-    
+        Return:
+        :StochasticResults <namedtuple>
+            time <array> (n_out, )
+            quantiles <array> (n_q, )
+            bands <array> (n_q, n_out, 4) with the quantiles of (S, I, R, D)
+            extinction_probability <array> (n_out, ) fraction of the 
+                replicates without infected at each time.
+            max_infected <array> (replicates, 2) with (day, infected) of the
+                maximum of each replicate.
+        """
+        assert replicates > 0, "replicates must be positive, got {}".format(replicates)
+        assert tau > 0, "tau must be positive, got {}".format(tau)
+        rng = np.random.default_rng(seed)
+        quantiles = np.asarray(quantiles, dtype=float)
+        decimation = max(1, int(round(output_every / tau)))
+        n_out = int(self.days / (decimation * tau)) + 1
+        time  = self.DAY_0 + decimation * tau * np.arange(n_out)
+        
+        gamma = self.RECO_RATE + self.MORTALITY
+        p_removed = -np.expm1(-gamma * tau)
+        p_death = self.MORTALITY / gamma if gamma > 0 else 0.0
+        
+        states = np.empty((replicates, 4), dtype=np.int64)
+        states[:] = np.rint(self.initial_state).astype(np.int64)
+        bands = np.empty((len(quantiles), n_out, 4))
+        extinction_probability = np.empty(n_out)
+        i_max = states[:, 1].copy()
+        day_max = np.full(replicates, float(self.DAY_0))
+        
+        for n in range(n_out):
+            if n > 0:
+                active = np.flatnonzero(states[:, 1] > 0)
+                s, i, r, d = states[active].T.copy()
+                i_max_a, day_max_a = i_max[active], day_max[active]
+                leaps = time[n - 1] + tau * np.arange(decimation)
+                cont_rates = self.contagiousRate(leaps) * tau / self.N_population
+                for t, cont_rate in zip((leaps + tau).tolist(), cont_rates.tolist()):
+                    infections = rng.binomial(s, -np.expm1(-cont_rate * i))
+                    removed = rng.binomial(i, p_removed)
+                    deaths  = rng.binomial(removed, p_death)
+                    s -= infections
+                    i += infections - removed
+                    r += removed - deaths
+                    d += deaths
+                    new_max = i > i_max_a
+                    np.copyto(i_max_a, i, where=new_max)
+                    np.copyto(day_max_a, t, where=new_max)
+                states[active] = np.column_stack((s, i, r, d))
+                i_max[active], day_max[active] = i_max_a, day_max_a
+            bands[:, n] = np.quantile(states, quantiles, axis=0)
+            extinction_probability[n] = np.mean(states[:, 1] == 0)
+        
+        return StochasticResults(time, quantiles, bands, extinction_probability,
+                                 np.column_stack((day_max, i_max)))
+
     GRAPH_LABEL = 0
+    _GRAPH_LABEL_LOCK = threading.Lock()
     @classmethod
     def graphLabelIncrement(cls):
-        cls.GRAPH_LABEL += 1
+        with cls._GRAPH_LABEL_LOCK:
+            cls.GRAPH_LABEL += 1
     def getDetails(self):
         print(self)
     
     @classmethod
     def stopWhenMaxInfectedReached(cls, stop=True):
         """ Call this method to set stop the execution when the maximum of 
-        infected is reached. Use it before the execution. """
+        infected is reached. Use it before creating the objects (or give 
+        stop_when_max_infected to the constructor). """
         cls.STOP_WHEN_MAX_INFECTED_ACHIEVED = stop
        
+    def peakEstimate(self):
+        """ Day and value of the maximum of infected, without running the model
+        (semi-analytic, see sirPeak), for a constant contagious rate (the 
+        initial value of a schedule). """
+        return sirPeak(self.N_population, self.CONT_FACTOR, self.RECO_RATE,
+                       self.MORTALITY, susceptible_0=self.initial_state[0],
+                       infected_0=self.initial_state[1], day_0=self.DAY_0)
+    
     def analyticalValueOfMaximumInfected(self):
         """ Analytic value for the maximum infected population for the model. """
         _C = self.N_population / self.R_0
-        return self.susceptible[0] + self.infected[0]\
-            - (_C * (1 + np.log(self.susceptible[0] / _C)))
+        return self.initial_state[0] + self.initial_state[1]\
+            - (_C * (1 + np.log(self.initial_state[0] / _C)))
     
     def graph(self, details=True, logY=False, grid=True):
         """ Graph the results using matplotlib, also prints the object inputs. """
@@ -8,34 +8,30 @@ Created on 18 mar. 2020
 #   OBTAIN CONTAGIOUS COEFICIENT (data since 12-2-20)
 # =============================================================================
 from datetime import datetime, timedelta 
+from collections import namedtuple
 import numpy as np
 from dataWebLoader import DataWebLoader
-from copy import copy, deepcopy
 
 def getContagiousRate(detected_list):
     """ 
     Args:
-    :detected_list with tuples:(day, infected, dead)
+    :detected_list with tuples:(day, infected, dead) or a table of 
+        COUNTRIES_DATA (array with these columns, also a dateRange view).
     
     Returns:
     :tuple 
         with exponential Slope + origin for infected,
         with exponential Slope + origin for deaths
         with the mortality and its stdv"""
-    tuple_ = list(zip(*detected_list))
-    if len(tuple_) == 3:
-        t, infected, dead = tuple_
-    elif len(tuple_) == 4:
-        t, infected, dead, active = tuple_
+    table = np.asarray(detected_list, dtype=float)
+    t, infected, dead = table[:, DAY], table[:, INFECTED], table[:, DEAD]
         
-    x = np.vstack([np.array(t), np.ones(len(t))]).T
-    infected = list(map(lambda i: np.log10(i), infected))
-    dead     = list(map(lambda d: np.log10(d+0.1), dead))
+    x = np.vstack([t, np.ones(len(t))]).T
+    # both fits with the same matrix at once
+    logs = np.column_stack((np.log10(infected), np.log10(dead + 0.1)))
+    (A_i, A_d), (B_i, B_d) = np.linalg.lstsq(x, logs, rcond=None)[0]
     
-    A_i, B_i = np.linalg.lstsq(x, infected, rcond=None)[0]
-    A_d, B_d = np.linalg.lstsq(x, dead, rcond=None)[0]
-    
-    mortality = list(map(lambda vals: vals[2]/vals[1], detected_list))
+    mortality = dead / infected
     return (
         round(A_i, 4), round(10**(B_i), 4),
         round(A_d, 4), round(10**(B_d), 4),
@@ -126,17 +122,31 @@ italy_detected = [
                   (43, 97689, 10779)
                   ]
 
-COUNTRIES_DATA = {'spain': spain_detected, 
-                  'italy': italy_detected}
+# Columns of the tables of COUNTRIES_DATA
+DAY, INFECTED, DEAD, ACTIVE = 0, 1, 2, 3
+
+def countryTable(detected_list):
+    """ Table of COUNTRIES_DATA from the rows (day, infected, dead[, active]):
+    a 2-D float array with a column for each value, sorted by day. """
+    table = np.array(detected_list, dtype=float, ndmin=2)
+    return table[np.argsort(table[:, DAY], kind='stable')]
+
+def dateRange(table, t_min=None, t_max=None):
+    """ Rows of a table with the days in [t_min, t_max], a view of the table 
+    (binary search of the limits, the days are sorted). """
+    days = table[:, DAY]
+    i_min = 0 if t_min is None else np.searchsorted(days, t_min, side='left')
+    i_max = len(days) if t_max is None else np.searchsorted(days, t_max, side='right')
+    return table[i_min:i_max]
+
+COUNTRIES_DATA = {'spain': countryTable(spain_detected), 
+                  'italy': countryTable(italy_detected)}
 
 def graphDataAndFit(data_list, A_i, B_i, A_d, B_d, t_min, t_max, name):
     import matplotlib.pyplot as plt
     
-    tuple_ = list(zip(*data_list))
-    if len(tuple_) == 3:
-        t, infected, dead = tuple_
-    elif len(tuple_) == 4:
-        t, infected, dead, active = tuple_
+    table = np.asarray(data_list, dtype=float)
+    t, infected, dead = table[:, DAY], table[:, INFECTED], table[:, DEAD]
         
     dates_t = [(t_0+timedelta(days=t_min + t)).date() for t in range(len(t))]
     fig, ax = plt.subplots()
@@ -169,28 +179,21 @@ def getRatesForDateRanges(date_min, date_max, date_prediction=None, graph=True):
     t_min = (date_min - t_0).days
     t_max = (date_max - t_0).days
     
-    dicts_ = deepcopy(COUNTRIES_DATA)
-    
     constants = {}
-    ## Set data in the range
-    for name, detected_list in dicts_.items():
-        i_min, i_max = None, 0
-        for i in range(len(detected_list)):
-            if (i == len(detected_list)-1):
-                i_max = i
-            if detected_list[i][0] >= t_min and i_min is None:
-                i_min = i
-            if (detected_list[i][0] >= t_max and not i_max):
-                i_max = i
-                break
+    ## Set data in the range (views of the tables): from the first day >= t_min
+    ## to the first day >= t_max (or the last one)
+    dicts_ = {}
+    for name, table in COUNTRIES_DATA.items():
+        days = table[:, DAY]
+        i_min = np.searchsorted(days, t_min, side='left')
+        i_max = min(np.searchsorted(days, t_max, side='left'), len(days) - 1)
         print(f"{name} -> i_min[{i_min}]  i_max[{i_max}]")
-        if i_min is None:
+        if i_min == len(days):
             return {}
-        dicts_[name] = detected_list[max(0, i_min) : min(i_max+1, 
-                                                         len(detected_list))]
+        dicts_[name] = table[i_min : i_max + 1]
 
     for name, detected_list in dicts_.items():
-        if detected_list == []:
+        if len(detected_list) == 0:
             continue
         print(name.upper()
                 +"   data from [{}] to [{}]".format(
@@ -218,6 +221,56 @@ def getRatesForDateRanges(date_min, date_max, date_prediction=None, graph=True):
     
     return constants
 
+# Results of rollingRates(), an array for each window
+RollingRates = namedtuple('RollingRates', 
+                          'day_min day_max infection_rate death_rate mortality mortality_std')
+
+def _windowSums(values, i_min, i_max):
+    """ Sums of the values over the rows [i_min, i_max) of each window """
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return cumulative[i_max] - cumulative[i_min]
+
+def rollingRates(country, window_days, t_min=None, t_max=None):
+    """
+    The fit of getContagiousRate for every window of window_days days of the
+    data of a country (a window starting on each day of the data, with the
+    rows from that day to window_days later). The slopes of the log-linear 
+    fits come from the closed form of the least squares line with the sums
+    of t, t^2, y and t*y over each window, computed for all the windows at 
+    once from cumulative sums.
+    Args:
+    :country, key of COUNTRIES_DATA.
+    :window_days, days of each window.
+    :t_min, t_max (optional) range of days of the data.
+    
+    Return:
+    :RollingRates <namedtuple> of arrays, (day_min, day_max) of each window
+        with at least two rows, the infection rate, the death rate and the
+        mean and std of the mortality (as in getContagiousRate).
+    """
+    table = dateRange(COUNTRIES_DATA[country], t_min, t_max)
+    t, infected, dead = table[:, DAY], table[:, INFECTED], table[:, DEAD]
+    
+    i_min = np.flatnonzero(t + window_days <= t[-1]) if len(t) else np.array([], dtype=int)
+    i_max = np.searchsorted(t, t[i_min] + window_days, side='right')
+    n = i_max - i_min
+    i_min, i_max, n = i_min[n > 1], i_max[n > 1], n[n > 1]
+    
+    # centered times (better conditioned sums)
+    x = t - t[:1].sum()
+    sum_x, sum_xx = _windowSums(x, i_min, i_max), _windowSums(x * x, i_min, i_max)
+    denominator = n * sum_xx - sum_x**2
+    def slope(y):
+        return (n * _windowSums(x * y, i_min, i_max) 
+                - sum_x * _windowSums(y, i_min, i_max)) / denominator
+    
+    mortality = dead / infected
+    mortality_mean = _windowSums(mortality, i_min, i_max) / n
+    mortality_var  = _windowSums(mortality**2, i_min, i_max) / n - mortality_mean**2
+    return RollingRates(t[i_min], t[i_max - 1], 
+                        slope(np.log10(infected)), slope(np.log10(dead + 0.1)),
+                        mortality_mean, np.sqrt(np.maximum(mortality_var, 0)))
+
 def graphRatesEvolution(window_infections, window_deaths, window_mortality,
                         date_min, window_delta_days):
     import matplotlib.pyplot as plt
@@ -257,7 +310,40 @@ def processWebData(country, data_dict):
     
     days = [(date - t_0.date()).days for date in dates]
     
-    COUNTRIES_DATA[country] = list(zip(days, totalInf, totalDeaths, totalActive))
+    COUNTRIES_DATA[country] = countryTable(list(zip(days, totalInf, totalDeaths, 
+                                                    totalActive)))
+
+def calibrationData(detected_list, t_min=None, t_max=None):
+    """ Rows (day, infected, recovered, dead) for the calibration of the SIR
+    model (optimizers) from the rows (day, total cases, dead, active) of 
+    processWebData: the infected of the model are the active cases and the
+    recovered the closed cases that did not die. The data starts on the first
+    day with active cases.
+    Args:
+    :detected_list with tuples: (day, infected, dead, active), or a table of
+        COUNTRIES_DATA.
+    :t_min, t_max (optional) range of days.
+    Return:
+    :<list of tuples> [(day, infected, recovered, dead)]
+    """
+    table = countryTable(detected_list)
+    assert table.shape[1] == 4, \
+        "the data needs the active cases, (day, infected, dead, active), see processWebData"
+    table = dateRange(table, t_min, t_max)
+    table = table[np.argmax(table[:, ACTIVE] > 0):] if table[:, ACTIVE].any() else table[:0]
+    recovered = np.maximum(table[:, INFECTED] - table[:, DEAD] - table[:, ACTIVE], 0)
+    return list(zip(table[:, DAY].tolist(), table[:, ACTIVE].tolist(), 
+                    recovered.tolist(), table[:, DEAD].tolist()))
+
+def calibrationDatasets(t_min=None, t_max=None):
+    """ calibrationData of every country of COUNTRIES_DATA with the active
+    cases (loaded with processWebData).
+    Return:
+    :<dict> country: <list of tuples> [(day, infected, recovered, dead)]
+    """
+    return dict((country, calibrationData(detected_list, t_min, t_max))
+                for country, detected_list in COUNTRIES_DATA.items()
+                if np.shape(detected_list)[1] == 4)
 
 def graphTotalVsActiveCases(t_min, t_max, logXaxis=True):
     """ Graph logarithmically the total cases against the currently active cases
@@ -267,8 +353,8 @@ def graphTotalVsActiveCases(t_min, t_max, logXaxis=True):
     
     fig, ax = plt.subplots()
     
-    for country, data_list in COUNTRIES_DATA.items():
-        t, infected, dead, active = zip(*data_list)
+    for country, table in COUNTRIES_DATA.items():
+        t, infected, dead, active = table.T
         _color = np.random.rand(3,)
         ax.plot(infected, active, '.-', c=_color ,label=f'{country}', alpha=0.5)
         ax.plot(infected[-1], active[-1], marker='P',c=_color, mec='k', ms=7)
@@ -336,32 +422,13 @@ if __name__ == '__main__':
 #        processWebData(country, tables)
 #        
 #    delta_days = 1 # window of days for the mean( 2*delta_days + 1) 
-#    date_min_MIN = date_min + timedelta(days=delta_days)
-#    date_max_MAX = date_max - timedelta(days=delta_days)
 #    
 #    for  country in countries:
-#        window_mean_infections = []
-#        window_mean_deaths = []
-#        window_mean_mortality = []
-#         
-#        date_min = copy(date_min_MIN)
-#        date_max = date_min + timedelta(days= 2*delta_days + 1)
-#        
-#        while(date_max <= date_max_MAX):
-#            results = getRatesForDateRanges(date_min, date_max, graph=False)
-#            
-#            date_min = date_min + timedelta(days=1)
-#            date_max = date_min + timedelta(days= 2*delta_days + 1)
-#            
-#            if not results:
-#                continue
-#            window_mean_infections.append(results[country][0])
-#            window_mean_deaths.append(results[country][1])
-#            window_mean_mortality.append(results[country][2:4])
-#            
-#        
-#        if window_mean_infections and window_mean_deaths and window_mean_mortality:
-#            graphRatesEvolution(window_mean_infections, window_mean_deaths, 
-#                                window_mean_mortality, date_min_MIN, delta_days)
+#        rates = rollingRates(country, 2*delta_days + 1, 
+#                             (date_min - t_0).days, (date_max - t_0).days)
+#        if len(rates.day_min):
+#            graphRatesEvolution(rates.infection_rate, rates.death_rate, 
+#                                list(zip(rates.mortality, rates.mortality_std)), 
+#                                t_0 + timedelta(days=rates.day_min[0]), delta_days)
             
     
@@ -5,6 +5,7 @@ Created on 18 mar. 2020
 '''
 from disease import DiseaseSimulation
 from optimizers import stepOptimizer, modelOptimizerFromData
+from parallelSweep import parallelSweep
 
 # =============================================================================
 #   RUN
@@ -32,7 +33,29 @@ if __name__ == '__main__':
         ds.graph(details=False)
         ds.getDetails()
         print(f"{ds.CONT_RATE}\t{ds.RECO_RATE}\t{ds.max_infected}\t({max_infected_analytical})")
-         
+
+    ## The same parameter sweep, integrated at once (without graphs)
+    results = DiseaseSimulation.runBatch(params_r_const + params_c_const,
+                                         t_step=0.005, mortality_rate=0.04)
+    print("CR\tRR\tmax_infected\tconvergence day")
+    for param, max_inf, conv_day in zip(params_r_const + params_c_const,
+                                        results.max_infected,
+                                        results.convergence_day):
+        print(f"{param[0]}\t{param[1]:6.4f}\t{max_inf}\t{conv_day}")
+
+    ## Daily trajectories of the sweep, one run per process
+    results = parallelSweep(params_r_const + params_c_const, output_every=1.0,
+                            t_step=0.005, mortality_rate=0.04)
+    print(results.trajectories.shape, results.max_infected)
+
+    ## Lockdown at the day 30 and relaxation at the day 60 (single run)
+    ds = DiseaseSimulation(contagious_rate=([0, 30, 60], [1.25, 0.3, 0.5]),
+                           recovery_rate=1/20., mortality_rate=0.04,
+                           t_step=0.005, backend=DiseaseSimulation.BACKEND_NUMPY,
+                           day_0=0)
+    ds()
+    print(ds.contagiousRate([0, 30, 60]), ds.max_infected)
+
     #===========================================================================
     # OPTIMIZATION OF STEP FOR FIXED PARAMETERS (Example)
     #===========================================================================
@@ -64,3 +87,11 @@ if __name__ == '__main__':
     params = modelOptimizerFromData(N_Population, params, data, h_max=0.01, 
                                     h_tolerance=0.05, data_tolerance=0.05)
     print(params)
+    
+    ## Same calibration with the Levenberg-Marquardt least squares fit
+    params = {'contagious_rate': 1.25, 
+              'recovery_rate': 1./7, 
+              'mortality_rate': 0.05}
+    params = modelOptimizerFromData(N_Population, params, data, h_max=0.01,
+                                    mode='least_squares')
+    print(params)
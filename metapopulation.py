@@ -0,0 +1,134 @@
+'''
+Created on 18 oct. 2026
+
+@author: Miguel
+'''
+import numpy as np
+
+from disease import DiseaseSimulation
+
+
+class MetapopulationSimulation(object):
+    """
+    SIR(D) model for K groups (regions, ages ...) coupled by a contact matrix,
+    the susceptible of the group k are infected with the force:
+        lambda_k = contagious_rate_k * sum_j(C[k, j] * I_j / N_j)
+    (with C the identity, each group is an independent DiseaseSimulation).
+    The states are (K, 4) arrays advanced with explicit Euler steps, with a
+    matrix-vector product per step (dense array or scipy.sparse matrix), and
+    only the states every output_every days are stored.
+    """
+
+    def __init__(self, N_population, contact_matrix, contagious_rate,
+                 recovery_rate, mortality_rate=0.0, infected_0=1,
+                 recovered_0=0, dead_0=0, t_step=0.01, days=200, day_0=0,
+                 output_every=1.0):
+        """
+        Args:
+        :N_population <array> (K, ) persons of each group.
+        :contact_matrix (K, K) <array> or scipy.sparse matrix, relative contacts
+            of the people of each group (rows) with the other groups (columns).
+        :contagious_rate, recovery_rate, mortality_rate, scalars or (K, )
+            arrays, as in DiseaseSimulation.
+        :infected_0, recovered_0, dead_0, scalars or (K, ) arrays.
+        :t_step, days, day_0 as in DiseaseSimulation.
+        :output_every (=1.0) days between the stored states (a multiple of
+            t_step).
+        """
+        self.N_population = np.asarray(N_population, dtype=float)
+        K = len(self.N_population)
+        if hasattr(contact_matrix, 'tocsr'):
+            contact_matrix = contact_matrix.tocsr()
+        else:
+            contact_matrix = np.asarray(contact_matrix, dtype=float)
+        assert contact_matrix.shape == (K, K), \
+            "contact_matrix must be ({0}, {0}), got {1}".format(K, contact_matrix.shape)
+        self.contact_matrix = contact_matrix
+
+        self.CONT_FACTOR = np.broadcast_to(np.asarray(contagious_rate, dtype=float), (K, ))
+        self.RECO_RATE   = np.broadcast_to(np.asarray(recovery_rate, dtype=float), (K, ))
+        self.MORTALITY   = np.broadcast_to(np.asarray(mortality_rate, dtype=float), (K, ))
+        self.R_0 = self.CONT_FACTOR / (self.RECO_RATE + self.MORTALITY)
+
+        self.t_step, self.days, self.DAY_0 = t_step, days, day_0
+        self.N_steps = int(round(days / t_step))
+        self.decimation = max(1, int(round(output_every / t_step)))
+        self.output_every = self.decimation * t_step
+
+        self.initial_state = np.empty((K, 4))
+        self.initial_state[:, 1] = infected_0
+        self.initial_state[:, 2] = recovered_0
+        self.initial_state[:, 3] = dead_0
+        self.initial_state[:, 0] = self.N_population - self.initial_state[:, 1:].sum(axis=1)
+
+        self._trajectory = self.initial_state[np.newaxis].copy()
+
+    @property
+    def K(self):
+        return len(self.N_population)
+
+    # =========================================================================
+    #   RESULTS
+    # =========================================================================
+    @property
+    def time(self):
+        return self.DAY_0 + self.output_every * np.arange(len(self._trajectory))
+
+    @property
+    def trajectory(self):
+        """ <array> (n, K, 4) with (S, I, R, D) of each group """
+        return self._trajectory
+
+    susceptible = property(lambda self: self._trajectory[:, :, 0])
+    infected    = property(lambda self: self._trajectory[:, :, 1])
+    recovered   = property(lambda self: self._trajectory[:, :, 2])
+    dead        = property(lambda self: self._trajectory[:, :, 3])
+
+    def total(self, var=DiseaseSimulation.INFECTED):
+        """ Sum of a variable ('susceptible', 'infected' ...) over the groups. """
+        return getattr(self, var).sum(axis=1)
+
+    @property
+    def max_infected(self):
+        """ <array> (K, 2) with (day, infected) of the maximum of each group
+        (of the stored states). """
+        i_max = np.argmax(self.infected, axis=0)
+        return np.column_stack((self.time[i_max],
+                                self.infected[i_max, np.arange(self.K)]))
+
+    # =========================================================================
+    #   INTEGRATION
+    # =========================================================================
+    def forceOfInfection(self, infected):
+        """ lambda_k for the (K, ) infected of each group. """
+        return self.CONT_FACTOR * (self.contact_matrix @ (infected / self.N_population))
+
+    def derivatives(self, state):
+        """ Time derivatives of the (K, 4) state. """
+        s, i = state[:, 0], state[:, 1]
+        infections = self.forceOfInfection(i) * s
+        recoveries, deaths = self.RECO_RATE * i, self.MORTALITY * i
+        return np.column_stack((-infections, infections - recoveries - deaths,
+                                recoveries, deaths))
+
+    def __call__(self):
+        """ Run the integration from day_0 to day_0 + days. """
+        n_out = self.N_steps // self.decimation + 1
+        self._trajectory = np.empty((n_out, self.K, 4))
+        self._trajectory[0] = self.initial_state
+
+        h = self.t_step
+        h_reco, h_mort = h * self.RECO_RATE, h * self.MORTALITY
+        s, i, r, d = (self.initial_state[:, j].copy() for j in range(4))
+        for step in range(1, (n_out - 1) * self.decimation + 1):
+            infections = h * self.forceOfInfection(i) * s
+            recoveries, deaths = h_reco * i, h_mort * i
+            s -= infections
+            i += infections - recoveries - deaths
+            r += recoveries
+            d += deaths
+            np.maximum(s, 0.0, out=s)
+            np.maximum(i, 0.0, out=i)
+            if step % self.decimation == 0:
+                row = self._trajectory[step // self.decimation]
+                row[:, 0], row[:, 1], row[:, 2], row[:, 3] = s, i, r, d
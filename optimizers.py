@@ -3,11 +3,28 @@ Created on 20 mar. 2020
 
 @author: Miguel
 '''
-from disease import DiseaseSimulation
+from disease import DiseaseSimulation, sirDerivatives, sirPeak
+from simulationCache import SimulationCache
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
+import os
 import numpy as np
 
-def stepOptimizer(h_max, tolerance=0.2, **diseaseKwargs):
+# Runs shared by the optimizers (give cache=None to run every model)
+SIMULATION_CACHE = SimulationCache()
+
+def runSimulation(cache=None, **diseaseKwargs):
+    """ DiseaseSimulation(**diseaseKwargs) after running it, or restored from
+    the cache if it is given and has a run with the same inputs. """
+    if cache is not None:
+        return cache.simulation(**diseaseKwargs)
+    model = DiseaseSimulation(**diseaseKwargs)
+    model()
+    return model
+
+def stepOptimizer(h_max, tolerance=0.2, exact_peak=True, cache=SIMULATION_CACHE,
+                  **diseaseKwargs):
     """ 
     This function iterates to find a value of the step for which the SIR simulation
     converges under a certain tolerance. The steps are divided by 2 in each 
@@ -15,24 +32,42 @@ def stepOptimizer(h_max, tolerance=0.2, **diseaseKwargs):
     Args:
     :h_max first step value.
     :tolerance (=0.2 by default), tolerance ratio on step (1.0 for 100%).
-    :diseaseKwargs, are the parameters for the DiseaseSimulation.
+    :exact_peak (=True) compare the maximum of each run with the semi-analytic
+        one (DiseaseSimulation.peakEstimate) instead of with the previous run,
+        which saves (at least) a simulation.
+    :cache (=SIMULATION_CACHE) SimulationCache for the runs (None to not use it).
+    :diseaseKwargs, are the parameters for the DiseaseSimulation (the runs
+        stop at the maximum of infected). With a contagious rate schedule the
+        runs are compared with the previous one (exact_peak is not used).
+    
+    With method='rk45' the integrator already controls the error with its 
+    tolerances (atol, rtol), so h_max is returned without iterating.
     
     Return:
     :h optimized or not.
     """
+    if diseaseKwargs.get('method') == DiseaseSimulation.METHOD_RK45:
+        return h_max
     
     max_vals_prev = (0,0)
     max_values = {}
     optimiced = False
-    DiseaseSimulation.stopWhenMaxInfectedReached(True)
+    diseaseKwargs = {**diseaseKwargs, 'stop_when_max_infected': True}
+    exact_peak = exact_peak and np.ndim(diseaseKwargs.get('contagious_rate', 0)) == 0
+    if exact_peak:
+        max_vals_exact = DiseaseSimulation(t_step=h_max, **diseaseKwargs).peakEstimate()
     for i in range(7):
         h = h_max / (2**(i))
         
-        ds_h = DiseaseSimulation(t_step= h, **diseaseKwargs)
-        ds_h()
+        ds_h = runSimulation(cache, t_step=h, **diseaseKwargs)
         max_vals = ds_h.max_infected
         
         max_values[h] = max_vals
+        if exact_peak:
+            if ((abs(max_vals[0]-max_vals_exact[0]) > tolerance*abs(max_vals_exact[0]))
+                 or (abs(max_vals[1]-max_vals_exact[1]) > tolerance*max_vals_exact[1])):
+                continue
+            return h
         if ((abs(max_vals[0]-max_vals_prev[0])/max_vals[0] > tolerance)
              or (abs(max_vals[1]-max_vals_prev[1])/max_vals[1] > tolerance)):
             max_vals_prev = max_vals
@@ -60,6 +95,38 @@ def stepOptimizer(h_max, tolerance=0.2, **diseaseKwargs):
 #===============================================================================
 #     MODEL PARAMETER FITTER
 #===============================================================================
+def warmStartParameters(store, N_population, parameters0, data):
+    """ Rates of the run (of a resultStore.ResultStore) that best fits the data
+    from its first row (same weighted residuals than leastSquaresFromData), 
+    or parameters0 if there are no runs with these initial values that 
+    reach the last day of the data (and the same days of the contagious 
+    rate schedule, if it is one).
+    """
+    config  = dataConfiguration(data)
+    schedule_days = fitSchedule(parameters0, config['day_0'])[0]
+    days    = np.array([row[0] for row in data[1:]], dtype=float)
+    observed, weights = dataWeights(data)
+    
+    best, best_cost = parameters0, np.inf
+    for run_hash, meta in store.runs(N_population=N_population, **config):
+        stored = storedParameters(meta['inputs'])
+        stored_days = fitSchedule(stored, config['day_0'])[0]
+        if ((schedule_days is None) != (stored_days is None)) or \
+                ((schedule_days is not None) and not np.array_equal(schedule_days, stored_days)):
+            continue
+        # the stored arrays (memory mapped) in a model, to interpolate them
+        # as its own run (DiseaseSimulation.at)
+        model = DiseaseSimulation(**{**meta['inputs'], **stored, 'print_logs': False})
+        model.restoreRunState(store.runState(run_hash), copy=False)
+        if model.time[-1] < days[-1]:
+            continue
+        values = model.at(days)[:, 1:]
+        cost = np.sum(((values - observed) * weights)**2)
+        if cost < best_cost:
+            best_cost = cost
+            best = stored
+    return best
+
 def toleranceAchieved(value_ini, value_post, tolerance = .05):
     return abs(value_ini - value_post)/value_post < tolerance
 
@@ -69,22 +136,92 @@ def paramStep(data_t, model_t, param_value):
 
 MAX_STEP = 50
 
+def dataConfiguration(data, **configKwargs):
+    """ Arguments for the DiseaseSimulation to start at the first row of the 
+    data (day, infected, recovered, dead), with other configuration options
+    (stop_when_max_infected, print_logs). """
+    return {'day_0': data[0][0],
+            'initializers': {'infected_0' : data[0][1], 
+                             'recovered_0': data[0][2],
+                             'dead_0'     : data[0][3]},
+            **configKwargs}
+
+def dataWeights(data):
+    """ (infected, recovered, dead) of the data after its first row (initial 
+    values), and the weights 1/sqrt(data) of their residuals.
+    Return:
+    <tuple> (observed, weights) <arrays> (n_data - 1, 3)
+    """
+    observed = np.array([row[1:4] for row in data[1:]], dtype=float)
+    return observed, 1 / np.sqrt(np.maximum(observed, 1))
+
 def modelOptimizerFromData(N_population, 
                            parameters0, 
                            data, 
                            h_max=0.01, 
                            h_tolerance=0.1, 
-                           data_tolerance=0.1):
+                           data_tolerance=0.1,
+                           mode='heuristic',
+                           cache=SIMULATION_CACHE,
+                           store=None,
+                           graph=True):
     """From a set of data, find the best parameters. Optimize h in each step
     Args:
     :h_max = 0.01
     :parameters0 <dict> ={contagious_rate, recovery_rate, mortality_rate}
     :data <list of tuples> = [(day, infected, recovered, dead)]
+    :mode (='heuristic') or 'least_squares' to calibrate with the
+        Levenberg-Marquardt fit of leastSquaresFromData (with t_step=h_max, 
+        h_tolerance and data_tolerance are not used), it also fits the values
+        of a contagious rate schedule (days, values). With 'posterior', the 
+        rates are sampled with posteriorFromData and the medians are returned
+        (the credible intervals are printed).
+    :cache (=SIMULATION_CACHE) SimulationCache for the runs of the heuristic
+        mode (None to not use it), the run with the optimized step is the 
+        last one of stepOptimizer.
+    :store (optional) resultStore.ResultStore, the calibration starts from
+        the stored run that best fits the data (instead of parameters0) and 
+        the run of the resultant parameters is saved in it.
+    :graph (=True) plot the evolution of the parameters and the resultant
+        model (requires matplotlib).
     
     Return:
     <tuple> The most upgraded parameter sets and time step achieved
     """
+    if store is not None:
+        parameters0 = warmStartParameters(store, N_population, parameters0, data)
+    if mode == 'least_squares':
+        params, covariance, evolutionParams = leastSquaresFromData(
+            N_population, parameters0, data, t_step=h_max)
+        for key, value, var in zip(*fitValues(params), np.diag(covariance)):
+            print(f"{key}:\t{value:8.6f} +/- {np.sqrt(var):8.6f}")
+        aux_params = {**params, 
+                      't_step': h_max,
+                      'days': 200, 
+                      'N_population': N_population}
+        if store is not None:
+            saveFinalRun(store, aux_params, data)
+        if graph:
+            graphEvolutionAndResultantModel(evolutionParams, aux_params, 
+                                            **dataConfiguration(data))
+        return aux_params
+    if mode == 'posterior':
+        posterior = posteriorFromData(N_population, parameters0, data, t_step=h_max)
+        for key, (low, median, high) in posterior.intervals.items():
+            print(f"{key}:\t{median:10.6g}  [{low:10.6g}, {high:10.6g}]")
+        aux_params = {**dict((key, posterior.intervals[key][1]) for key in FIT_KEYS),
+                      't_step': h_max,
+                      'days': 200, 
+                      'N_population': N_population}
+        if store is not None:
+            saveFinalRun(store, aux_params, data)
+        if graph:
+            graphEvolutionAndResultantModel([aux_params], aux_params, 
+                                            **dataConfiguration(data))
+        return aux_params
     
+    assert np.ndim(parameters0['contagious_rate']) == 0, \
+        "the heuristic mode fits a constant contagious_rate, use mode='least_squares'"
     # TODO: Many variables could be grouped, avoiding single purpose definitions
     # TODO: Refactor in simple functions, excessive extension and cumbersome
     # TODO: Generalize the model for a general number of recoveries
@@ -94,12 +231,8 @@ def modelOptimizerFromData(N_population,
                   'days': 200, 
                   'N_population': N_population}
     post_params = {}
-    iniArgs = {'day_0' : data[0][0], 'infected_0' : data[0][1], 
-               'dead_0': data[0][3], 'recovered_0': data[0][2]}
     # Set up the first elements for t, infect, ... with the first data row
-    DiseaseSimulation.setInitializers(**iniArgs)
-    DiseaseSimulation.stopWhenMaxInfectedReached(True)
-    DiseaseSimulation.setLogsPrint(False)
+    config = dataConfiguration(data, stop_when_max_infected=True, print_logs=False)
     
     dataTolAchieved = [dict([(key, False) for key in parameters0])
                        for _ in data]
@@ -112,35 +245,29 @@ def modelOptimizerFromData(N_population,
         ITER += 1
         # Adapt the time step (stepOptimizer)
         del aux_params['t_step']
-        t_step = stepOptimizer(h_max, tolerance=h_tolerance, **aux_params)
+        t_step = stepOptimizer(h_max, tolerance=h_tolerance, cache=cache,
+                               **aux_params, **config)
         # Calculate the difference between the data and the model(with t_step optimized)
         # in t_data time. For equations of
         #          Death->M,  Recovered->RR,  (RR, M ,N, Infected)->CR
         aux_params['t_step'] = t_step
-        model = DiseaseSimulation(**aux_params)
-        model()
+        model = runSimulation(cache, **aux_params, **config)
         # Calculate the step for each parameter as a difference data normalized 
         # by the minimum(difference).
-        result_zip = model.getResults()
-        #result_zip = (day, SUSCEPTIBLE, INFECTED, RECOVERED, DEAD)
+        # model states at the days of the data: (SUSCEPTIBLE, INFECTED, RECOVERED, DEAD)
+        model_values = model.at([row[0] for row in data])
         aux_rates = [dict([(key, 0) for key in keys]) for i in data]
         for i in range(len(data)):
             tuple_data = data[i]
-            day = tuple_data[0]
             infc, reco, dead = tuple_data[1], tuple_data[2], tuple_data[3]
+            element = model_values[i]
             
-            _elem = 0
-            for element in result_zip:
-                if round(abs(element[0] - day), 6) > t_step:
-                    _elem += 1
-                    continue
-                post_params[keys[0]] = paramStep(reco, element[3], aux_params[keys[0]])
-                post_params[keys[1]] = paramStep(dead, element[4], aux_params[keys[1]])
-                post_params[keys[2]] = paramStep(infc, element[2], aux_params[keys[2]]) 
-                
-                for k in range(3):
-                    aux_rates[i][keys[k]] = post_params[keys[k]]
-                break
+            post_params[keys[0]] = paramStep(reco, element[2], aux_params[keys[0]])
+            post_params[keys[1]] = paramStep(dead, element[3], aux_params[keys[1]])
+            post_params[keys[2]] = paramStep(infc, element[1], aux_params[keys[2]]) 
+            
+            for k in range(3):
+                aux_rates[i][keys[k]] = post_params[keys[k]]
             # check an arbitrary value of tolerance, return the parameters and t_step 
             # if it's exceeded
             for key in parameters0:
@@ -157,14 +284,450 @@ def modelOptimizerFromData(N_population,
         
         evolutionParams.append(aux_params)
         
-    DiseaseSimulation.stopWhenMaxInfectedReached(False)
-    graphEvolutionAndResultantModel(evolutionParams, aux_params)
+    if store is not None:
+        saveFinalRun(store, aux_params, data)
+    if graph:
+        graphEvolutionAndResultantModel(evolutionParams, aux_params, 
+                                        **dataConfiguration(data))
     
     return aux_params
 
 
-def graphEvolutionAndResultantModel(evolutionParams, finalParams):
-    cRates = [cc['contagious_rate'] for cc in evolutionParams]
+FIT_KEYS = ('contagious_rate', 'recovery_rate', 'mortality_rate')
+
+def fitSchedule(parameters, day_0=0):
+    """ (days, values) of the contagious rate schedule of the parameters, 
+    (None, [contagious_rate]) if it is constant. """
+    schedule = DiseaseSimulation.parseContagiousRate(parameters['contagious_rate'], day_0)
+    if schedule is None:
+        return None, np.array([parameters['contagious_rate']], dtype=float)
+    return schedule
+
+def fitValues(parameters, day_0=0):
+    """ Names and values of the fitted rates (a contagious rate for each value
+    of a schedule, then the recovery and mortality rates).
+    Return:
+    :<tuple> (<list> of names, <array> of values)
+    """
+    days, cont_values = fitSchedule(parameters, day_0)
+    names = (['contagious_rate'] if days is None else 
+             ['contagious_rate[{}]'.format(j) for j in range(len(days))])
+    values = np.concatenate((cont_values, [parameters['recovery_rate'], 
+                                           parameters['mortality_rate']]))
+    return names + list(FIT_KEYS[1:]), values
+
+def fitParameters(values, schedule_days=None):
+    """ Inverse of fitValues: the parameters <dict> of the fitted values. """
+    values = [float(value) for value in values]
+    contagious_rate = values[0]
+    if schedule_days is not None:
+        contagious_rate = (np.asarray(schedule_days, dtype=float), np.array(values[:-2]))
+    return dict(zip(FIT_KEYS, [contagious_rate] + values[-2:]))
+
+def storedParameters(inputs):
+    """ Parameters <dict> of the inputs of a stored run (see 
+    ResultStore.inputs), with the schedule as a tuple (days, values). """
+    contagious_rate = inputs['contagious_rate']
+    if isinstance(contagious_rate, list):
+        contagious_rate = tuple(np.array(array, dtype=float) for array in contagious_rate)
+    return {**dict((key, inputs[key]) for key in FIT_KEYS), 
+            'contagious_rate': contagious_rate}
+
+def saveFinalRun(store, params, data):
+    """ Save in the store the run of the calibrated parameters from the first
+    row of the data (to warm start the next calibrations). """
+    params = dict((key, float(value)) if (key in FIT_KEYS) and (np.ndim(value) == 0)
+                  else (key, value) for key, value in params.items())
+    model = runSimulation(None, backend=DiseaseSimulation.BACKEND_NUMPY, **params,
+                          **dataConfiguration(data, stop_when_max_infected=False,
+                                              print_logs=False))
+    store.save(model)
+
+def modelAtDataDays(N_population, parameters, data, t_step=0.01, 
+                    sensitivities=False):
+    """ Run the model from the first row of the data (initial values) to the 
+    last one.
+    Return:
+    <array> (n_data, 3) with the (infected, recovered, dead) of the model at 
+    the days of the data. With sensitivities, also their derivatives by the
+    rates in fitValues order <array> (n_data, 3, n_rates).
+    """
+    days = np.array([row[0] for row in data], dtype=float)
+    model = DiseaseSimulation(t_step=t_step, 
+                              days=days[-1] - days[0], 
+                              N_population=N_population,
+                              backend=DiseaseSimulation.BACKEND_NUMPY,
+                              record_at=days,
+                              sensitivities=sensitivities,
+                              **parameters,
+                              **dataConfiguration(data, stop_when_max_infected=False,
+                                                  print_logs=False))
+    model()
+    values = np.column_stack((model.infected, model.recovered, model.dead))
+    if len(values) < len(days):
+        # The disease was eradicated before the last day
+        values = np.vstack((values, np.repeat(values[-1:], len(days) - len(values), 0)))
+    if not sensitivities:
+        return values
+    d_values = model.sensitivities[:, 1:]
+    if len(d_values) < len(days):
+        d_values = np.concatenate((d_values, np.repeat(d_values[-1:], 
+                                                       len(days) - len(d_values), 0)))
+    return values, d_values
+
+def leastSquaresFromData(N_population, 
+                         parameters0, 
+                         data, 
+                         t_step=0.01, 
+                         max_iterations=MAX_STEP, 
+                         tolerance=1e-6,
+                         print_logs=True,
+                         details=False):
+    """
+    Calibrate the contagious, recovery and mortality rates with the 
+    Levenberg-Marquardt method. If the contagious rate is a schedule (days, 
+    values), its values are fitted (the days are kept). The residuals are (model - data)/sqrt(data)
+    for the infected, recovered and dead at the days of the data, and the 
+    rates are fitted in logarithmic scale (to keep them positive). The 
+    Jacobian comes from the sensitivity equations integrated with the model, 
+    so each evaluation is a single run.
+    Args:
+    :N_population
+    :parameters0 <dict> ={contagious_rate, recovery_rate, mortality_rate}
+        first estimation (all > 0), the contagious rate could be a schedule
+        as in DiseaseSimulation.
+    :data <list of tuples> = [(day, infected, recovered, dead)], the first
+        row gives the initial values.
+    :t_step (=0.01) step for the Euler integration ('numpy' backend).
+    :max_iterations, tolerance, stop when the relative change of the 
+        parameters or of the residuals is under tolerance.
+    :print_logs (=True) print the residual of each iteration.
+    :details (=False) also return the norm of the weighted residuals of the
+        fitted parameters and if the fit converged (the tolerance is reached 
+        or no step reduces the residuals, not max_iterations).
+    
+    Return:
+    <tuple> (parameters <dict>, covariance of the parameters <array> 
+        (n_rates, n_rates) in fitValues order, evolution of the parameters 
+        <list of dict>), and the residual <float> and converged <bool> if 
+        details are requested.
+    """
+    schedule_days, _ = fitSchedule(parameters0, data[0][0])
+    if schedule_days is not None:
+        # a value that is not used between the first and the last day of the
+        # data has a null column in the Jacobian (it cannot be fitted)
+        assert (len(schedule_days) == 1) or ((schedule_days[1] > data[0][0]) and 
+                                             (schedule_days[-1] < data[-1][0])), \
+            "every value of the schedule must be used between the days {} and {} "\
+            "of the data, got the days {}".format(data[0][0], data[-1][0], 
+                                                  schedule_days.tolist())
+    observed, weights = dataWeights(data)
+    
+    def residuals(theta):
+        """ residuals and their Jacobian by theta = log(rates) """
+        rates = np.exp(theta)
+        values, d_values = modelAtDataDays(N_population, 
+                                           fitParameters(rates, schedule_days), 
+                                           data, t_step, sensitivities=True)
+        res = ((values[1:] - observed) * weights).ravel()
+        # d/d log(rate) = rate * d/d rate
+        jac = d_values[1:] * weights[..., np.newaxis] * rates
+        return res, jac.reshape(len(res), len(theta))
+    
+    theta = np.log(fitValues(parameters0, data[0][0])[1])
+    res, jac = residuals(theta)
+    cost  = res @ res
+    lambda_ = 1e-3
+    evolutionParams = [fitParameters(np.exp(theta), schedule_days)]
+    converged = False
+    for ITER in range(max_iterations):
+        A, g = jac.T @ jac, jac.T @ res
+        # increase the damping until the step reduces the residuals
+        while lambda_ < 1e10:
+            # (the floor keeps it invertible with a null column)
+            step = np.linalg.solve(A + lambda_ * np.diag(np.maximum(np.diag(A), 1e-12)), -g)
+            res_new, jac_new = residuals(theta + step)
+            cost_new = res_new @ res_new
+            if cost_new < cost:
+                break
+            lambda_ *= 10
+        else:
+            # minimum (up to the precision of the residuals)
+            converged = True
+            break
+        converged = bool((np.abs(step).max() < tolerance * (np.abs(theta).max() + tolerance))
+                         or (cost - cost_new < tolerance * cost))
+        theta, res, jac, cost = theta + step, res_new, jac_new, cost_new
+        lambda_ = max(lambda_ / 10, 1e-12)
+        evolutionParams.append(fitParameters(np.exp(theta), schedule_days))
+        if print_logs:
+            print(f"ITER LSQ:{ITER}  residual: {np.sqrt(cost):10.4f}")
+        if converged:
+            break
+    if print_logs and not converged:
+        print("WARNING: MAX ITERATIONS reached, least squares NOT CONVERGED")
+    
+    # Covariance of the rates from the one of log(rates)
+    dof = max(1, len(res) - len(theta))
+    cov_theta = (cost / dof) * np.linalg.pinv(jac.T @ jac)
+    rates = np.exp(theta)
+    covariance = cov_theta * np.outer(rates, rates)
+    
+    if details:
+        return (fitParameters(rates, schedule_days), covariance, evolutionParams, 
+                float(np.sqrt(cost)), converged)
+    return fitParameters(rates, schedule_days), covariance, evolutionParams
+
+
+#===============================================================================
+#     MULTI-START CALIBRATION
+#===============================================================================
+# Ranges of the random starts of calibrateCountries (log-uniform)
+START_RANGES = {'contagious_rate': (0.05, 2.0),
+                'recovery_rate'  : (1/30., 1/3.),
+                'mortality_rate' : (1e-3, 0.1)}
+
+def _calibrationWorker(country, N_population, data, parameters0, t_step):
+    """ Least squares fit of a country from a start.
+    Return:
+    :<tuple> (country, parameters <dict> or None if the fit failed, residual,
+        converged <bool>)
+    """
+    try:
+        with np.errstate(all='ignore'):
+            params, _, _, residual, converged = leastSquaresFromData(
+                N_population, parameters0, data, t_step, print_logs=False, details=True)
+    except (np.linalg.LinAlgError, ValueError, FloatingPointError):
+        return country, None, np.inf, False
+    if not np.isfinite(residual):
+        return country, None, np.inf, False
+    return country, params, residual, converged
+
+def calibrateCountries(datasets, populations, n_starts=8, parameters0=None,
+                       t_step=0.01, seed=None, max_workers=None):
+    """
+    Calibrate the rates of many countries at once: a least squares fit 
+    (leastSquaresFromData) for each country and each of n_starts initial 
+    parameter sets, all of them in a pool of processes, keeping the best fit
+    of each country (a single start can stop in a local minimum).
+    Args:
+    :datasets <dict> country: <list of tuples> [(day, infected, recovered, dead)]
+        (see fitData.calibrationDatasets).
+    :populations <dict> country: N_population
+    :n_starts (=8) initial parameter sets for each country, random (log-uniform
+        in START_RANGES) except parameters0 if it is given.
+    :parameters0 (optional) <dict> first start, as in leastSquaresFromData.
+    :t_step (=0.01) step of the Euler integration.
+    :seed (optional) of the random starts.
+    :max_workers (=os.cpu_count()) processes of the pool.
+    
+    Return:
+    :<dict> country: <dict> with contagious_rate, recovery_rate, 
+        mortality_rate, R_0, residual (of the best fit, converged or not), 
+        the number of fits (starts that did not fail) and of them the number
+        that converged (None for the countries without any fit).
+    """
+    rng = np.random.default_rng(seed)
+    starts = [dict(parameters0)] if parameters0 else []
+    while len(starts) < n_starts:
+        starts.append(dict((key, float(np.exp(rng.uniform(*np.log(START_RANGES[key])))))
+                           for key in FIT_KEYS))
+    
+    table = dict((country, None) for country in datasets)
+    fits = dict((country, 0) for country in datasets)
+    converged = dict((country, 0) for country in datasets)
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_calibrationWorker, country, populations[country],
+                                   data, start, t_step)
+                   for country, data in datasets.items() for start in starts]
+        for future in futures:
+            country, params, residual, fit_converged = future.result()
+            if params is None:
+                continue
+            fits[country] += 1
+            converged[country] += fit_converged
+            best = table[country]
+            if (best is None) or (residual < best['residual']):
+                R_0 = params['contagious_rate'] / (params['recovery_rate'] 
+                                                   + params['mortality_rate'])
+                table[country] = {**params, 'R_0': R_0, 'residual': residual}
+    
+    print("country\tcontagious_rate\trecovery_rate\tmortality_rate\tR_0\tresidual\t"
+          "fits\tconverged")
+    for country, row in table.items():
+        if row is None:
+            print(f"{country}\t(no fit)")
+            continue
+        row['fits'], row['converged'] = fits[country], converged[country]
+        print(f"{country}\t{row['contagious_rate']:8.6f}\t{row['recovery_rate']:8.6f}\t"
+              f"{row['mortality_rate']:8.6f}\t{row['R_0']:6.3f}\t{row['residual']:10.4f}\t"
+              f"{fits[country]}/{len(starts)}\t{converged[country]}/{len(starts)}")
+    return table
+
+
+#===============================================================================
+#     POSTERIOR SAMPLING
+#===============================================================================
+# Results of posteriorFromData()
+PosteriorResults = namedtuple('PosteriorResults', 
+                              'samples R_0 max_infected acceptance intervals')
+
+def modelBatchAtDataDays(N_population, rates, data, t_step=0.01):
+    """ modelAtDataDays for many sets of (constant) rates at once: the states
+    of all the sets are a (n_sets, 4) matrix advanced with one array operation
+    per Euler step (as DiseaseSimulation.runBatch), only the ones at the days
+    of the data (rounded to the steps) are kept.
+    Args:
+    :rates <array> (n_sets, 3) in FIT_KEYS order.
+    Return:
+    <array> (n_sets, n_data, 3) with the (infected, recovered, dead).
+    """
+    rates = np.array(rates, dtype=float, ndmin=2)
+    cont, reco, mort = rates[:, 0] / N_population, rates[:, 1], rates[:, 2]
+    days = np.array([row[0] for row in data], dtype=float)
+    record_steps = np.rint((days - days[0]) / t_step).astype(int)
+    
+    state = np.empty((len(rates), 4))
+    state[:] = (N_population - sum(data[0][1:4]),) + tuple(data[0][1:4])
+    values = np.empty((len(rates), len(days), 3))
+    values[:, record_steps == 0] = state[:, np.newaxis, 1:]
+    for step in range(1, record_steps[-1] + 1):
+        np.clip(state + t_step*sirDerivatives(state, cont, reco, mort),
+                0.01, N_population, out=state)
+        values[:, record_steps == step] = state[:, np.newaxis, 1:]
+    return values
+
+def _logLikelihood(theta, N_population, data, t_step, variance):
+    """ Log-likelihood of the data for each row of theta = log(rates), with
+    the residuals of leastSquaresFromData (normal, with this variance). """
+    observed, weights = dataWeights(data)
+    with np.errstate(over='ignore', invalid='ignore'):
+        values = modelBatchAtDataDays(N_population, np.exp(theta), data, t_step)
+        cost = np.sum(((values[:, 1:] - observed) * weights)**2, axis=(1, 2))
+    return np.where(np.isfinite(cost), -0.5 * cost / variance, -np.inf)
+
+def _metropolisChain(N_population, data, theta0, covariance0, variance, 
+                     n_walkers, n_iterations, burn_in, t_step, seed):
+    """
+    Adaptive Metropolis with n_walkers independent walkers proposed and 
+    evaluated at once (one modelBatchAtDataDays per iteration). The proposal
+    is a normal with the covariance of the samples (2.38^2/d scaled), 
+    adapted during the burn in and fixed after it.
+    Return:
+    :<tuple> (samples <array> (n_samples, 3) of log(rates), number of 
+        accepted proposals after the burn in)
+    """
+    rng = np.random.default_rng(seed)
+    n_dim = len(theta0)
+    scale = 2.38**2 / n_dim
+    proposal_cov = scale * covariance0
+    logL = lambda theta: _logLikelihood(theta, N_population, data, t_step, variance)
+    
+    theta = rng.multivariate_normal(theta0, covariance0, size=n_walkers)
+    log_l = logL(theta)
+    chain = np.empty((n_iterations, n_walkers, n_dim))
+    accepted = 0
+    for ITER in range(n_iterations):
+        if (ITER < burn_in) and (ITER >= 50) and (ITER % 50 == 0):
+            recent = chain[ITER // 2 : ITER].reshape(-1, n_dim)
+            proposal_cov = scale * (np.cov(recent.T) + 1e-12 * np.eye(n_dim))
+        proposal = theta + rng.multivariate_normal(np.zeros(n_dim), proposal_cov, 
+                                                   size=n_walkers)
+        log_l_new = logL(proposal)
+        accept = np.log(rng.random(n_walkers)) < log_l_new - log_l
+        theta[accept], log_l[accept] = proposal[accept], log_l_new[accept]
+        chain[ITER] = theta
+        if ITER >= burn_in:
+            accepted += accept.sum()
+    return chain[burn_in:].reshape(-1, n_dim), accepted
+
+def posteriorFromData(N_population, 
+                      parameters0, 
+                      data, 
+                      t_step=0.01,
+                      n_chains=4,
+                      n_walkers=32,
+                      n_iterations=1000,
+                      burn_in=300,
+                      credible=0.9,
+                      seed=None,
+                      max_workers=None,
+                      print_logs=False):
+    """
+    Posterior samples of the contagious, recovery and mortality rates (flat 
+    prior in logarithmic scale) with adaptive Metropolis chains. The 
+    likelihood is normal on the residuals of leastSquaresFromData, with their
+    variance estimated by the least squares fit, which also gives the start
+    and the first proposal covariance of the chains. Each chain moves 
+    n_walkers walkers evaluated in batches (modelBatchAtDataDays), and the 
+    chains run in a pool of processes.
+    Args:
+    :N_population, parameters0, data, t_step as in leastSquaresFromData 
+        (constant contagious rate).
+    :n_chains (=4) independent chains (processes).
+    :n_walkers (=32), n_iterations (=1000), burn_in (=300) of each chain, 
+        there are n_chains * n_walkers * (n_iterations - burn_in) samples.
+    :credible (=0.9) probability of the intervals.
+    :seed (optional) for numpy.random.SeedSequence, the same seed gives the
+        same samples.
+    :max_workers (=os.cpu_count()) processes of the pool (1 to run the chains 
+        in this process).
+    :print_logs (=False) print the iterations of the least squares fit.
+    
+    Return:
+    :PosteriorResults <namedtuple>
+        samples <array> (n_samples, 3) rates in FIT_KEYS order.
+        R_0 <array> (n_samples, )
+        max_infected <array> (n_samples, 2) with (day, infected) of the 
+            peak of each sample (see disease.sirPeak).
+        acceptance <float> ratio of the accepted proposals.
+        intervals <dict> (low, median, high) of the rates, 'R_0', 
+            'max_infected_day' and 'max_infected'.
+    """
+    assert np.ndim(parameters0['contagious_rate']) == 0, \
+        "posteriorFromData samples a constant contagious_rate"
+    assert burn_in < n_iterations, \
+        "burn_in ({}) must be less than n_iterations ({})".format(burn_in, n_iterations)
+    params, covariance, _ = leastSquaresFromData(N_population, parameters0, data, t_step,
+                                                 print_logs=print_logs)
+    rates0 = np.array([params[key] for key in FIT_KEYS])
+    theta0 = np.log(rates0)
+    covariance0 = covariance / np.outer(rates0, rates0)
+    n_res = 3 * (len(data) - 1)
+    variance = max(-2 * _logLikelihood(theta0[np.newaxis], N_population, data, 
+                                       t_step, 1.0)[0] / max(1, n_res - 3), 1e-12)
+    
+    seeds = np.random.SeedSequence(seed).spawn(n_chains)
+    args = [(N_population, data, theta0, covariance0, variance, n_walkers,
+             n_iterations, burn_in, t_step, chain_seed) for chain_seed in seeds]
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        chains = [_metropolisChain(*chain_args) for chain_args in args]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, n_chains)) as executor:
+            chains = list(executor.map(_metropolisChain, *zip(*args)))
+    
+    samples = np.exp(np.concatenate([chain for chain, _ in chains]))
+    acceptance = sum(accepted for _, accepted in chains) / len(samples)
+    R_0 = samples[:, 0] / (samples[:, 1] + samples[:, 2])
+    day_0, infected_0 = data[0][0], data[0][1]
+    max_infected = np.column_stack(sirPeak(N_population, samples[:, 0], samples[:, 1],
+                                           samples[:, 2], 
+                                           N_population - sum(data[0][1:4]),
+                                           infected_0, day_0))
+    
+    tails = 100 * np.array([(1 - credible) / 2, 0.5, (1 + credible) / 2])
+    columns = dict(zip(FIT_KEYS, samples.T))
+    columns.update({'R_0': R_0, 'max_infected_day': max_infected[:, 0],
+                    'max_infected': max_infected[:, 1]})
+    intervals = dict((key, tuple(np.percentile(values, tails).tolist())) 
+                     for key, values in columns.items())
+    
+    return PosteriorResults(samples, R_0, max_infected, acceptance, intervals)
+
+
+def graphEvolutionAndResultantModel(evolutionParams, finalParams, **configKwargs):
+    cRates = [fitSchedule(cc)[1] for cc in evolutionParams]
     rRates = [cc['recovery_rate'] for cc in evolutionParams]
     mRates = [cc['mortality_rate'] for cc in evolutionParams]
     
@@ -182,8 +745,7 @@ def graphEvolutionAndResultantModel(evolutionParams, finalParams):
     #===========================================================================
     #     PRINT MODEL WITH RESULTS
     #===========================================================================
-    DiseaseSimulation.setLogsPrint(True)
-    model = DiseaseSimulation(**finalParams)
+    model = DiseaseSimulation(**finalParams, **{'print_logs': True, **configKwargs})
     model()
     print(model)
     model.graph()
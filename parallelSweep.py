@@ -0,0 +1,125 @@
+'''
+Created on 18 oct. 2026
+
+@author: Miguel
+'''
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+from disease import DiseaseSimulation
+
+# Results of parallelSweep()
+SweepResults = namedtuple('SweepResults', 'time trajectories max_infected')
+
+# =============================================================================
+#   WORKERS
+# =============================================================================
+
+def _sweepWorker(shm_name, shape, indices, param_list, diseaseKwargs):
+    """
+    Run the simulations of a chunk of the sweep and write their trajectories
+    in the shared memory block (rows [index, :n, :]).
+    Return:
+    :<list> of (index, max_infected)
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        cube = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        results = []
+        for index, params in zip(indices, param_list):
+            model = DiseaseSimulation(**diseaseKwargs, **params)
+            model()
+            n = min(model._n, shape[1])
+            cube[index, :n, 0] = model.susceptible[:n]
+            cube[index, :n, 1] = model.infected[:n]
+            cube[index, :n, 2] = model.recovered[:n]
+            cube[index, :n, 3] = model.dead[:n]
+            results.append((index, model.max_infected))
+        del cube
+    finally:
+        shm.close()
+    return results
+
+def _paramsDict(params):
+    """ (contagious_rate, recovery_rate[, mortality_rate]) or dict to kwargs """
+    if isinstance(params, dict):
+        return dict(params)
+    keys = ('contagious_rate', 'recovery_rate', 'mortality_rate')
+    return dict(zip(keys, (float(p) for p in params)))
+
+# =============================================================================
+#   SWEEP
+# =============================================================================
+
+def parallelSweep(param_grid, output_every=1.0, max_workers=None, chunksize=None,
+                  **diseaseKwargs):
+    """
+    Run a DiseaseSimulation for each parameter set in a pool of processes.
+    The trajectories are written by the workers in a shared memory block
+    (n_params, n_rows, 4) on the common grid of output_every days, so only
+    the maximums are sent back to the caller.
+    Initial values and the stop criteria are the ones of the class when it is
+    called (the processes do not share the class attributes), unless they are
+    given as in the constructor (day_0, initializers, stop_when_max_infected).
+    Args:
+    :param_grid <list> of tuples (contagious_rate, recovery_rate[, mortality_rate])
+        or of dicts with the arguments of the constructor that change.
+    :output_every (=1.0) days between the rows of the trajectories.
+    :max_workers (=os.cpu_count()) processes of the pool.
+    :chunksize (optional) parameter sets for each task, by default the
+        grid is split in 4 tasks per process.
+    :diseaseKwargs, the common parameters for the DiseaseSimulation (t_step,
+        days, N_population, method ...), the runs use the 'numpy' backend if
+        the method is euler.
+
+    Return:
+    :SweepResults <namedtuple>
+        time <array> (n_rows, ) days of the rows.
+        trajectories <array> (n_params, n_rows, 4) with (S, I, R, D), NaN
+            after the end of the runs that converged before days.
+        max_infected <list> of (day, infected) or None for each parameter set.
+    """
+    param_list = [_paramsDict(params) for params in param_grid]
+    diseaseKwargs = {'backend': DiseaseSimulation.BACKEND_NUMPY,
+                     'day_0': DiseaseSimulation.DAY_0,
+                     'initializers': dict(DiseaseSimulation.INITIALIZERS),
+                     'stop_when_max_infected': 
+                         DiseaseSimulation.STOP_WHEN_MAX_INFECTED_ACHIEVED,
+                     **diseaseKwargs,
+                     'print_logs': False}
+    n_rows = int(round(diseaseKwargs.get('days', 200) / output_every)) + 1
+    time = diseaseKwargs['day_0'] + output_every * np.arange(n_rows)
+    diseaseKwargs['record_at'] = time
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, -(-len(param_list) // (4 * max_workers)))
+
+    shape = (len(param_list), n_rows, 4)
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(1, int(np.prod(shape)) * 8))
+    try:
+        cube = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        cube.fill(np.nan)
+        max_infected = [None] * len(param_list)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for start in range(0, len(param_list), chunksize):
+                indices = list(range(start, min(start + chunksize, len(param_list))))
+                futures.append(executor.submit(_sweepWorker, shm.name, shape,
+                                               indices, param_list[start : start + chunksize],
+                                               diseaseKwargs))
+            for future in futures:
+                for index, max_inf in future.result():
+                    max_infected[index] = max_inf
+        trajectories = cube.copy()
+        del cube
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return SweepResults(time, trajectories, max_infected)
@@ -0,0 +1,202 @@
+'''
+Created on 18 oct. 2026
+
+@author: Miguel
+'''
+import hashlib
+import json
+import numbers
+import os
+import threading
+
+import numpy as np
+
+
+def _floatNumbers(key):
+    """ Copy of a (nested) key with its numbers (not booleans) as floats. """
+    if isinstance(key, (tuple, list)):
+        return [_floatNumbers(item) for item in key]
+    if isinstance(key, (bool, np.bool_)):
+        return bool(key)
+    if isinstance(key, (numbers.Number, np.number)):
+        return float(key)
+    return key
+
+
+class ResultStore(object):
+    """
+    Results of DiseaseSimulation runs saved in a directory, one folder per
+    run named by the hash of its inputs (DiseaseSimulation.cacheKey) with an
+    .npy file for each array and a meta.json, plus an index.json of all the
+    runs. The arrays are loaded memory mapped (read only), so opening the
+    results of a big sweep does not read them.
+
+    Usage:
+        store = ResultStore('results')
+        if not store.load(model):   # restore the results of the same inputs
+            model()
+            store.save(model)
+    """
+    INDEX  = 'index.json'
+    META   = 'meta.json'
+    ARRAYS = ('trajectory', 'time', 'sensitivities')
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = self.__readIndex()
+
+    @staticmethod
+    def hashKey(key):
+        """ Content address of a cacheKey. The numbers are hashed as floats,
+        so keys that are equal (f.e. with N_population=200000 or 200000.0,
+        or numpy scalars) have the same hash. """
+        text = json.dumps(_floatNumbers(key), default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def __readIndex(self):
+        path = os.path.join(self.directory, self.INDEX)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def __writeJson(self, path, content):
+        """ Write in a temporary file and replace, the readers never find it
+        half written. """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, model):
+        return self.hashKey(model.cacheKey()) in self._index
+
+    def __repr__(self):
+        return "ResultStore('{}', runs={})".format(self.directory, len(self))
+
+    # =========================================================================
+    #   SAVE / LOAD
+    # =========================================================================
+    @staticmethod
+    def inputs(model):
+        """ Inputs of the run of a model <dict> (to select stored runs), a 
+        contagious rate schedule is saved as [days, values] lists. """
+        contagious_rate = float(model.CONT_FACTOR)
+        if model.contagious_schedule is not None:
+            contagious_rate = [array.tolist() for array in model.contagious_schedule]
+        return {'t_step'         : model.t_step,
+                'days'           : model.days,
+                'N_population'   : model.N_population,
+                'contagious_rate': contagious_rate,
+                'recovery_rate'  : float(model.RECO_RATE),
+                'mortality_rate' : float(model.MORTALITY),
+                'backend'        : model.backend,
+                'method'         : model.method,
+                'day_0'          : model.DAY_0,
+                'initializers'   : model.INITIALIZERS,
+                'stop_when_max_infected': model.STOP_WHEN_MAX_INFECTED_ACHIEVED}
+
+    def save(self, model):
+        """ Save the results of the last run of the model.
+        Return:
+        :<str> hash of the run.
+        """
+        run_hash = self.hashKey(model.cacheKey())
+        folder = os.path.join(self.directory, run_hash)
+        os.makedirs(folder, exist_ok=True)
+
+        state = model.runState()
+        arrays = []
+        for name in self.ARRAYS:
+            if state[name] is not None:
+                tmp = os.path.join(folder, '{}.{}.tmp.npy'.format(name, os.getpid()))
+                np.save(tmp, state[name])
+                os.replace(tmp, os.path.join(folder, name + '.npy'))
+                arrays.append(name)
+        events = dict((name, [float(t), np.asarray(y, dtype=float).tolist()])
+                      for name, (t, y) in state['events'].items())
+        meta = {'inputs'      : self.inputs(model),
+                'arrays'      : arrays,
+                'n'           : len(state['trajectory']),
+                'nbytes'      : state['nbytes'],
+                'uniform_time': state['uniform_time'],
+                'converged'   : bool(state['converged']),
+                'max_infected': state['max_infected'],
+                'events'      : events}
+        self.__writeJson(os.path.join(folder, self.META), meta)
+
+        with self._lock:
+            self._index[run_hash] = meta
+            self.__writeJson(os.path.join(self.directory, self.INDEX), self._index)
+        return run_hash
+
+    def runState(self, run_hash):
+        """ State of a stored run for DiseaseSimulation.restoreRunState, with
+        the arrays memory mapped (None if it is not stored). """
+        meta = self._index.get(run_hash)
+        if meta is None:
+            return None
+        folder = os.path.join(self.directory, run_hash)
+        state = dict((name, None) for name in self.ARRAYS)
+        for name in meta['arrays']:
+            state[name] = np.load(os.path.join(folder, name + '.npy'), mmap_mode='r')
+        max_infected = meta['max_infected']
+        state.update({'uniform_time': meta['uniform_time'],
+                      'converged'   : meta['converged'],
+                      'max_infected': None if max_infected is None else tuple(max_infected),
+                      'events'      : dict((name, (t, np.array(y)))
+                                           for name, (t, y) in meta['events'].items()),
+                      'nbytes'      : meta['nbytes']})
+        return state
+
+    def load(self, model, copy=False):
+        """ Restore in the model the results of a stored run with its inputs.
+        Args:
+        :copy (=False) the arrays of the model are read only memory maps of
+            the files, or copies in memory.
+        Return:
+        :<bool> True if the run was stored.
+        """
+        state = self.runState(self.hashKey(model.cacheKey()))
+        if state is None:
+            return False
+        model.restoreRunState(state, copy=copy)
+        return True
+
+    def runs(self, **inputs):
+        """ Hashes and meta data of the stored runs with these inputs (f.e.
+        N_population=6550000, day_0=17).
+        Return:
+        :<list> of (run_hash, meta <dict>)
+        """
+        return [(run_hash, meta) for run_hash, meta in self._index.items()
+                if all(meta['inputs'].get(key) == value for key, value in inputs.items())]
+
+    def remove(self, run_hash):
+        """ Delete a stored run. """
+        folder = os.path.join(self.directory, run_hash)
+        with self._lock:
+            self._index.pop(run_hash, None)
+            self.__writeJson(os.path.join(self.directory, self.INDEX), self._index)
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+            os.rmdir(folder)
+
+    def reindex(self):
+        """ Build the index from the meta data of the folders (f.e. after
+        saving runs from several processes at once). """
+        index = {}
+        for run_hash in os.listdir(self.directory):
+            path = os.path.join(self.directory, run_hash, self.META)
+            if os.path.exists(path):
+                with open(path) as f:
+                    index[run_hash] = json.load(f)
+        with self._lock:
+            self._index = index
+            self.__writeJson(os.path.join(self.directory, self.INDEX), index)
@@ -0,0 +1,113 @@
+'''
+Created on 18 oct. 2026
+
+@author: Miguel
+'''
+from collections import OrderedDict
+import threading
+
+from disease import DiseaseSimulation
+
+
+class SimulationCache(object):
+    """
+    Least recently used cache of the results of DiseaseSimulation runs, keyed
+    by DiseaseSimulation.cacheKey() (step, days, population, rates, initial
+    values, stop criteria ...). The entries are evicted when there are more
+    than max_entries or their arrays take more than max_bytes. With a
+    ResultStore, the runs are also saved in disk and searched there when
+    they are not in memory.
+
+    Usage:
+        cache = SimulationCache()
+        model = cache.run(DiseaseSimulation(**kwargs))  # runs or restores
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 2**20, store=None):
+        """
+        Args:
+        :max_entries (=128) number of runs to keep.
+        :max_bytes (=256 MB) memory for the arrays of the runs (a run larger
+            than it is not stored).
+        :store (optional) resultStore.ResultStore, second level of the cache.
+        """
+        assert max_entries > 0, "max_entries must be positive, got {}".format(max_entries)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, model):
+        return model.cacheKey() in self._entries
+
+    def __repr__(self):
+        return ("SimulationCache(entries={}/{}, MB={:.2f}/{:.2f}, hits={}, misses={}, "
+                "store_hits={})".format(len(self), self.max_entries, self.nbytes / 2**20,
+                                        self.max_bytes / 2**20, self.hits, 
+                                        self.misses, self.store_hits))
+
+    def get(self, key):
+        """ Stored run state for the key (None if it is not stored). """
+        with self._lock:
+            state = self._entries.get(key)
+            if state is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return state
+
+    def put(self, key, state):
+        """ Store the run state for the key, evicting the least recently used
+        entries to keep the limits. """
+        if state['nbytes'] > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)['nbytes']
+            self._entries[key] = state
+            self.nbytes += state['nbytes']
+            while (len(self._entries) > self.max_entries) or (self.nbytes > self.max_bytes):
+                _key, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted['nbytes']
+
+    def run(self, model):
+        """ Run the model (see DiseaseSimulation.__call__), or restore the
+        results of a previous run with the same inputs.
+        Return:
+        :the model, with its results.
+        """
+        key = model.cacheKey()
+        state = self.get(key)
+        if (state is None) and (self.store is not None):
+            # memory mapped arrays, read when they are restored
+            state = self.store.runState(self.store.hashKey(key))
+            if state is not None:
+                self.store_hits += 1
+                self.put(key, state)
+        if state is not None:
+            model.restoreRunState(state)
+        else:
+            model()
+            self.put(key, model.runState())
+            if self.store is not None:
+                self.store.save(model)
+        return model
+
+    def simulation(self, **diseaseKwargs):
+        """ DiseaseSimulation(**diseaseKwargs) after running it (or restoring it). """
+        return self.run(DiseaseSimulation(**diseaseKwargs))
+
+    def clear(self):
+        """ Remove every entry and reset the counters. """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = self.hits = self.misses = self.store_hits = 0